@@ -4,6 +4,16 @@ infra = {
         "second_8_bits": "34",  # the second 8 bits of the Sano VPC CIDR block
         "region": "eu-west-2",
         "domain": "sanogenetics.org",
+        # (key regex, Cache-Control) rules for portal/admin assets, checked before
+        # the defaults in infra/asset_policy.py
+        "cache_control_rules": [
+            (r"^static/fonts/", "public, max-age=31536000, immutable"),
+        ],
+        "precompress": "gzip",  # "gzip" or None
+        # lifecycle of the versions deploys leave behind in the portal/admin buckets
+        "noncurrent_version_expiration_days": 30,
+        "noncurrent_versions_to_retain": 3,
+        "abort_incomplete_multipart_upload_days": 7,
     },
     "dev": {
         "portal_subdomain": "dev.",
@@ -0,0 +1,59 @@
+import gzip
+import re
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# (key regex, Cache-Control) rules for frontend assets, the first match wins
+# orgs can put their own rules in front of these with "cache_control_rules"
+DEFAULT_CACHE_CONTROL_RULES = [
+    # entry documents must always be revalidated so they never point at old bundles
+    (r"(^|/)(index|app)\.html$", "no-cache"),
+    # per env settings injected when an artifact is promoted
+    (r"(^|/)runtime-config\.json$", "no-cache"),
+    # fingerprinted bundles, e.g. main.3f2a1b9c.js, never change under the same name
+    (r"[.-](?=[0-9a-f]*[0-9])[0-9a-f]{8,}(\.chunk)?\.[A-Za-z0-9]+$", IMMUTABLE),
+    (r".*", "max-age=3600"),
+]
+
+# content types worth compressing before upload
+COMPRESSIBLE_TYPES = re.compile(
+    r"^(text/.*|application/(javascript|json|xml|manifest\+json)|image/svg\+xml)$"
+)
+
+
+def compress(content):
+    # mtime=0 keeps the output, and so its hash, stable between builds
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+# decides the Cache-Control and Content-Encoding each frontend asset is uploaded with
+# S3 does not negotiate encodings, so a precompressed object is served to every client
+# with that encoding, which is why gzip, understood by every client, is the only one
+class AssetPolicy:
+    def __init__(self, cache_control_rules=(), precompress="gzip"):
+        self.cache_control_rules = [
+            (re.compile(pattern), cache_control)
+            for pattern, cache_control in list(cache_control_rules)
+            + DEFAULT_CACHE_CONTROL_RULES
+        ]
+        if precompress not in ["gzip", None]:
+            raise ValueError(f"Cannot precompress with {precompress}, only gzip or None")
+        self.precompress = precompress
+
+    @classmethod
+    def from_infra_config(cls, infra_config):
+        return cls(
+            cache_control_rules=infra_config.get("cache_control_rules", ()),
+            precompress=infra_config.get("precompress", "gzip"),
+        )
+
+    def cache_control(self, key):
+        for pattern, cache_control in self.cache_control_rules:
+            if pattern.search(key):
+                return cache_control
+
+    # the encoding to precompress an asset with, or None to upload it as is
+    def encoding(self, content_type):
+        if self.precompress and content_type and COMPRESSIBLE_TYPES.match(content_type):
+            return self.precompress
+        return None
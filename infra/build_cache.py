@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import os
+import shutil
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), ".cache", "builds")
+# env agnostic release builds, promoted unchanged from env to env
+ARTIFACT_DIR = os.path.join(os.path.dirname(__file__), ".cache", "artifacts")
+# directories of a frontend that are not part of its sources
+IGNORED_DIRECTORIES = {"node_modules", "dist", ".git", ".cache"}
+LOCKFILES = ["package.json", "package-lock.json", "npm-shrinkwrap.json", "yarn.lock"]
+# written into node_modules after an install, with the hash of the lockfile it installed
+INSTALL_STAMP = os.path.join("node_modules", ".infra-lockfile-hash")
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def lockfile_hash(directory):
+    digest = hashlib.sha256()
+    for lockfile in LOCKFILES:
+        path = os.path.join(directory, lockfile)
+        if os.path.exists(path):
+            digest.update(f"{lockfile}:{hash_file(path)}\n".encode())
+    return digest.hexdigest()
+
+
+def source_tree_hash(directory):
+    digest = hashlib.sha256()
+    for root, directories, files in os.walk(directory):
+        directories[:] = sorted(d for d in directories if d not in IGNORED_DIRECTORIES)
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            relative_path = os.path.relpath(path, directory).replace(os.sep, "/")
+            digest.update(f"{relative_path}:{hash_file(path)}\n".encode())
+    return digest.hexdigest()
+
+
+# whether the node_modules of a frontend are missing or were installed from another
+# lockfile
+def needs_install(directory):
+    try:
+        with open(os.path.join(directory, INSTALL_STAMP)) as fp:
+            return fp.read().strip() != lockfile_hash(directory)
+    except FileNotFoundError:
+        return True
+
+
+def record_install(directory):
+    with open(os.path.join(directory, INSTALL_STAMP), "w") as fp:
+        fp.write(lockfile_hash(directory))
+
+
+# content addressed cache of a frontend's build output, keyed by its lockfile, its
+# sources and the build target, so an unchanged frontend is never installed or built
+class BuildCache:
+    def __init__(self, directory, target, output_dir, cache_dir=CACHE_DIR, keep=10):
+        self.directory = directory
+        self.target = target
+        self.output_dir = output_dir
+        self.cache_dir = cache_dir
+        self.keep = keep
+        # the cache entry last restored or stored
+        self.cached_output = None
+
+    # computed afresh each time, as npm install may rewrite the lockfile
+    @property
+    def key(self):
+        digest = hashlib.sha256()
+        digest.update(os.path.abspath(self.directory).encode())
+        digest.update(self.target.encode())
+        digest.update(lockfile_hash(self.directory).encode())
+        digest.update(source_tree_hash(self.directory).encode())
+        return digest.hexdigest()
+
+    # copies a cached build into the output directory, returning whether there was one
+    def restore(self):
+        cached_output = os.path.join(self.cache_dir, self.key)
+        if not os.path.isdir(cached_output):
+            return False
+        logger.info(f"Reusing cached build {os.path.basename(cached_output)}")
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+        shutil.copytree(cached_output, self.output_dir)
+        os.utime(cached_output)
+        self.cached_output = cached_output
+        return True
+
+    def store(self):
+        cached_output = os.path.join(self.cache_dir, self.key)
+        self.cached_output = cached_output
+        if os.path.isdir(cached_output):
+            return
+        # copy next to the final path first so a half written entry is never used
+        temporary_output = f"{cached_output}.{os.getpid()}.tmp"
+        shutil.copytree(self.output_dir, temporary_output)
+        try:
+            os.rename(temporary_output, cached_output)
+        except OSError:
+            # another run cached the same build in the meantime
+            shutil.rmtree(temporary_output, ignore_errors=True)
+            return
+        logger.info(f"Cached build {os.path.basename(cached_output)}")
+        self.prune()
+
+    # removes all but the most recently used cached builds
+    def prune(self):
+        entries = sorted(
+            (
+                os.path.join(self.cache_dir, entry)
+                for entry in os.listdir(self.cache_dir)
+                if not entry.endswith(".tmp")
+            ),
+            key=os.path.getmtime,
+            reverse=True,
+        )
+        for entry in entries[self.keep :]:
+            shutil.rmtree(entry, ignore_errors=True)
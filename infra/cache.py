@@ -0,0 +1,110 @@
+import fcntl
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), ".cache", "discovery.json")
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+
+# on-disk cache of identifiers discovered from AWS, with a TTL per entry
+# entries are namespaced (e.g. by profile/region/org/env) so envs and accounts never mix
+# the env worker processes of a parallel run share the file, see locked()
+class DiscoveryCache:
+    def __init__(self, namespace, path=DEFAULT_CACHE_PATH):
+        self.namespace = namespace
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path) as fp:
+                return json.load(fp)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    # writes to a temporary file first so concurrent readers never see a partial file
+    def save(self, entries):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temporary_path, "w") as fp:
+            json.dump(entries, fp, indent=2, sort_keys=True)
+        os.replace(temporary_path, self.path)
+
+    # holds the cache file for a read-modify-write, against the other threads of this
+    # process and against other processes
+    @contextmanager
+    def locked(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock, open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, name):
+        entry = self.load().get(self.namespace, {}).get(name)
+        if entry is None or entry["expires_at"] < time.time():
+            return None
+        return entry["value"]
+
+    def set(self, name, value, ttl):
+        with self.locked():
+            entries = self.load()
+            entries.setdefault(self.namespace, {})[name] = {
+                "value": value,
+                "expires_at": time.time() + ttl,
+            }
+            self.save(entries)
+
+    def invalidate(self, *names):
+        with self.locked():
+            entries = self.load()
+            namespace_entries = entries.get(self.namespace, {})
+            if any(name in namespace_entries for name in names):
+                for name in names:
+                    namespace_entries.pop(name, None)
+                self.save(entries)
+
+    def clear(self):
+        with self.locked():
+            entries = self.load()
+            if entries.pop(self.namespace, None) is not None:
+                self.save(entries)
+
+    # returns the cached value, or fetches and caches it
+    # values that were not found (None or empty) are never cached
+    def get_or_fetch(self, name, ttl, fetch):
+        value = self.get(name)
+        if value is not None:
+            logger.debug(f"Using cached {name} for {self.namespace}")
+            return value
+        value = fetch()
+        if value:
+            self.set(name, value, ttl)
+        return value
+
+
+# caches the return value of a StackManager method in its discovery cache
+# the name may contain format fields, which are filled in with the method's arguments
+def cached(name, ttl):
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args):
+            return self.cache.get_or_fetch(
+                name.format(*args), ttl, lambda: method(self, *args)
+            )
+
+        return wrapper
+
+    return decorator
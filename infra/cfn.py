@@ -0,0 +1,182 @@
+import json
+import logging
+import uuid
+
+from botocore.exceptions import ClientError
+
+from polling import wait_until
+
+logger = logging.getLogger(__name__)
+
+# the CDK stacks may create IAM resources and use macros
+CAPABILITIES = ["CAPABILITY_IAM", "CAPABILITY_NAMED_IAM", "CAPABILITY_AUTO_EXPAND"]
+# larger templates must be uploaded to S3 first, which is left to the cdk CLI
+MAX_TEMPLATE_BODY_SIZE = 51200
+# change sets fail, or are rejected, with one of these when the template matches the
+# deployed stack
+NO_CHANGES_REASONS = ["didn't contain changes", "No updates are to be performed"]
+
+
+# returns the description of a stack, or None if it does not exist
+def get_stack(cloudformation_client, stack):
+    try:
+        return cloudformation_client.describe_stacks(StackName=stack)["Stacks"][0]
+    except ClientError as e:
+        if "does not exist" in str(e):
+            return None
+        raise
+
+
+def event_record(event):
+    return {
+        "timestamp": event["Timestamp"].isoformat(),
+        "stack": event["StackName"],
+        "logical_id": event["LogicalResourceId"],
+        "resource_type": event["ResourceType"],
+        "status": event["ResourceStatus"],
+        "reason": event.get("ResourceStatusReason"),
+    }
+
+
+# the events of a stack since it was created, logged as structured records as they
+# come in, see poll()
+class StackEvents:
+    def __init__(self, cloudformation_client, stack_id):
+        self.cloudformation_client = cloudformation_client
+        self.stack_id = stack_id
+        self.records = []
+        # only events after the newest one already there are streamed
+        events = cloudformation_client.describe_stack_events(StackName=stack_id)
+        self.last_event_id = next(
+            (event["EventId"] for event in events["StackEvents"]), None
+        )
+
+    # logs and returns the events since the last poll, oldest first
+    def poll(self):
+        events = []
+        paginator = self.cloudformation_client.get_paginator("describe_stack_events")
+        # events are listed newest first, so stop at the last one seen
+        for page in paginator.paginate(StackName=self.stack_id):
+            for event in page["StackEvents"]:
+                if event["EventId"] == self.last_event_id:
+                    break
+                events.append(event)
+            else:
+                continue
+            break
+        if events:
+            self.last_event_id = events[0]["EventId"]
+
+        records = [event_record(event) for event in reversed(events)]
+        for record in records:
+            logger.info(
+                f"{record['stack']} {record['logical_id']} ({record['resource_type']}) "
+                f"{record['status']}"
+                + (f": {record['reason']}" if record["reason"] else ""),
+                extra={"stack_event": record},
+            )
+        self.records.extend(records)
+        return records
+
+    # the reasons resources failed, to explain a failed deploy or delete
+    def failure_reasons(self):
+        return [
+            f"{record['logical_id']}: {record['reason']}"
+            for record in self.records
+            if record["status"].endswith("_FAILED") and record["reason"]
+        ]
+
+
+# streams the events of a stack until it settles, returning its final status
+def wait_for_stack(cloudformation_client, events, description, timeout=3600):
+    def settled_status():
+        events.poll()
+        status = cloudformation_client.describe_stacks(StackName=events.stack_id)[
+            "Stacks"
+        ][0]["StackStatus"]
+        return None if status.endswith("_IN_PROGRESS") else status
+
+    return wait_until(settled_status, description, timeout=timeout, max_delay=15)
+
+
+# creates a change set of the stack for the template and executes it, returning
+# whether there were any changes
+def deploy_stack(cloudformation_client, stack, template, parameters=None, tags=None):
+    existing = get_stack(cloudformation_client, stack)
+    if existing and existing["StackStatus"] == "ROLLBACK_COMPLETE":
+        # stacks that failed to create can't be updated, only replaced
+        logger.info(f"Deleting {stack}, which failed to create before")
+        delete_stack(cloudformation_client, stack)
+        existing = None
+    # stacks only reviewed so far were created by an earlier, unexecuted change set
+    change_set_type = (
+        "UPDATE"
+        if existing and existing["StackStatus"] != "REVIEW_IN_PROGRESS"
+        else "CREATE"
+    )
+
+    try:
+        response = cloudformation_client.create_change_set(
+            StackName=stack,
+            ChangeSetName=f"infra-{uuid.uuid4().hex}",
+            ChangeSetType=change_set_type,
+            TemplateBody=json.dumps(template),
+            Parameters=[
+                {"ParameterKey": key, "ParameterValue": value}
+                for key, value in (parameters or {}).items()
+            ],
+            Capabilities=CAPABILITIES,
+            Tags=[{"Key": key, "Value": value} for key, value in (tags or {}).items()],
+        )
+    except ClientError as e:
+        # some endpoints reject a change set without changes rather than failing it
+        if any(no_changes in str(e) for no_changes in NO_CHANGES_REASONS):
+            logger.info(f"{stack} has no changes")
+            return False
+        raise
+    change_set_id = response["Id"]
+
+    def created_change_set():
+        change_set = cloudformation_client.describe_change_set(
+            ChangeSetName=change_set_id
+        )
+        if change_set["Status"] in ["CREATE_PENDING", "CREATE_IN_PROGRESS"]:
+            return None
+        return change_set
+
+    change_set = wait_until(created_change_set, f"change set of {stack}")
+    if change_set["Status"] == "FAILED":
+        reason = change_set.get("StatusReason", "")
+        if any(no_changes in reason for no_changes in NO_CHANGES_REASONS):
+            cloudformation_client.delete_change_set(ChangeSetName=change_set_id)
+            logger.info(f"{stack} has no changes")
+            return False
+        raise RuntimeError(f"Creating a change set of {stack} failed: {reason}")
+
+    logger.info(
+        f"Executing {change_set_type.lower()} change set of {stack} "
+        f"({len(change_set.get('Changes', []))} changes)"
+    )
+    events = StackEvents(cloudformation_client, response["StackId"])
+    cloudformation_client.execute_change_set(ChangeSetName=change_set_id)
+    status = wait_for_stack(cloudformation_client, events, f"{stack} to deploy")
+    if status not in ["CREATE_COMPLETE", "UPDATE_COMPLETE"]:
+        raise RuntimeError(
+            f"Deploying {stack} failed with {status}: {events.failure_reasons()}"
+        )
+    return True
+
+
+def delete_stack(cloudformation_client, stack):
+    existing = get_stack(cloudformation_client, stack)
+    if existing is None:
+        logger.info(f"{stack} does not exist")
+        return
+    # deleted stacks can only be described by their id
+    events = StackEvents(cloudformation_client, existing["StackId"])
+    cloudformation_client.delete_stack(StackName=existing["StackId"])
+    status = wait_for_stack(cloudformation_client, events, f"{stack} to delete")
+    if status != "DELETE_COMPLETE":
+        raise RuntimeError(
+            f"Deleting {stack} failed with {status}: {events.failure_reasons()}"
+        )
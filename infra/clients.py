@@ -0,0 +1,37 @@
+import threading
+
+import boto3
+from botocore.config import Config
+
+# enough connections for the threads of parallel steps and uploads
+DEFAULT_MAX_POOL_CONNECTIONS = 32
+DEFAULT_MAX_ATTEMPTS = 10
+
+
+# the boto3 clients of one session, created on first use and shared after that
+# clients are thread safe, so every step of a run can share them, and they all retry
+# adaptively, slowing down once AWS starts throttling
+class ClientRegistry:
+    def __init__(
+        self,
+        profile_name=None,
+        max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+    ):
+        self.session = boto3.Session(profile_name=profile_name)
+        self.config = Config(
+            max_pool_connections=max_pool_connections,
+            retries={"mode": "adaptive", "total_max_attempts": max_attempts},
+        )
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    # the client of a service in a region, the session's region by default
+    def get(self, service, region=None):
+        key = (service, region or self.session.region_name)
+        with self.lock:
+            if key not in self.clients:
+                self.clients[key] = self.session.client(
+                    service, region_name=key[1], config=self.config
+                )
+            return self.clients[key]
@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import os
+import re
+import signal
+import subprocess
+import time
+from collections import deque
+
+from tracing import span, tracer
+
+logger = logging.getLogger(__name__)
+
+# how many of the last lines of output a command keeps, e.g. to report a failure
+DEFAULT_TAIL = 200
+# the longest line run_all() reads from a command, asyncio's default is 64KiB
+LINE_LIMIT = 1024 * 1024
+
+
+# result is its only arg, so it can be pickled back from a worker process
+class CommandFailed(Exception):
+    def __init__(self, result):
+        super().__init__(result)
+        self.result = result
+
+    def __str__(self):
+        return (
+            f"Command failed ({self.result.reason()}): {self.result.command}\n"
+            + self.result.output
+        )
+
+
+class CommandResult:
+    def __init__(self, command, returncode, tail, duration, aborted=None):
+        self.command = command
+        self.returncode = returncode
+        self.tail = tail
+        self.duration = duration
+        # why a matcher stopped the command, see run()
+        self.aborted = aborted
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and self.aborted is None
+
+    @property
+    def output(self):
+        return "\n".join(self.tail)
+
+    def reason(self):
+        if self.aborted:
+            return self.aborted
+        return f"exit code {self.returncode}"
+
+
+# a command for run_all(), whose output is logged prefixed with its name
+class Command:
+    def __init__(
+        self, name, command, matchers=(), timeout=None, tail=DEFAULT_TAIL, **kwargs
+    ):
+        self.name = name
+        self.command = command
+        self.matchers = matchers
+        self.timeout = timeout
+        self.tail = tail
+        # passed on to create_subprocess_shell, e.g. cwd
+        self.kwargs = kwargs
+
+
+# a matcher that stops a command on the first line containing text
+def fail_on(text):
+    def matcher(line):
+        if text in line:
+            return f"output contains {text!r}: {line}"
+        return None
+
+    return matcher
+
+
+# a command with the values of its -c key=value options (cdk context, which holds
+# secrets like db_password) masked, for traces that are shared
+def redact(command):
+    return re.sub(r"(-c [^\s=]+=)\S+", r"\1***", command)
+
+
+# a short name for a command in traces, e.g. zappa update dev_demo for
+# source venv/bin/activate && zappa update dev_demo
+def command_name(command):
+    name = redact(command).split("&&")[-1].strip()
+    return name if len(name) <= 60 else f"{name[:57]}..."
+
+
+# yields the lines a process writes to stdout as they come, until it closes it
+def stream_lines(process):
+    for line in process.stdout:
+        yield line.decode(errors="replace").rstrip()
+
+
+# runs a command in the shell, logging its output line by line and keeping only its
+# last lines in memory
+# matchers are called with every line and stop the command by returning a reason,
+# with check a failed or stopped command raises CommandFailed
+def run(command, matchers=(), check=False, tail=DEFAULT_TAIL, **kwargs):
+    with span(command_name(command), "command", command=redact(command)):
+        return run_traced(command, matchers, check, tail, **kwargs)
+
+
+def run_traced(command, matchers, check, tail, **kwargs):
+    start = time.monotonic()
+    lines = deque(maxlen=tail)
+    aborted = None
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        shell=True,
+        # its own process group, so a stopped command takes its children with it
+        start_new_session=True,
+        **kwargs,
+    )
+    with process:
+        try:
+            for line in stream_lines(process):
+                logger.info(line)
+                lines.append(line)
+                aborted = next(
+                    filter(None, (matcher(line) for matcher in matchers)), None
+                )
+                if aborted:
+                    logger.error(f"Stopping command, {aborted}")
+                    os.killpg(process.pid, signal.SIGTERM)
+                    break
+        except BaseException:
+            # its own session doesn't get the terminal's Ctrl-C, so it is passed on, e.g.
+            # so that an aborted cdk deploy stops too
+            stop(process)
+            raise
+        returncode = process.wait()
+
+    result = CommandResult(
+        command, returncode, list(lines), time.monotonic() - start, aborted
+    )
+    log_result(result)
+    if check and not result.ok:
+        raise CommandFailed(result)
+    return result
+
+
+def log_result(result, prefix=""):
+    logger.info(
+        f"{prefix}Command {'succeeded' if result.ok else 'failed'} in "
+        f"{result.duration:.1f}s ({result.reason()}): {result.command}"
+    )
+
+
+def stop(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        # it has already exited
+        pass
+
+
+# runs a command like run(), within the event loop and with an optional timeout
+# a cancelled command is stopped before the cancellation carries on
+async def run_async(command):
+    # commands run side by side in one thread, so each gets its own row in traces
+    tid = id(command)
+    tracer.name_thread(tid, command.name)
+    with span(
+        command_name(command.command), "command", tid, command=redact(command.command)
+    ):
+        return await run_async_traced(command)
+
+
+async def run_async_traced(command):
+    prefix = f"[{command.name}] "
+    start = time.monotonic()
+    lines = deque(maxlen=command.tail)
+    spawn = asyncio.ensure_future(
+        asyncio.create_subprocess_shell(
+            command.command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True,
+            limit=LINE_LIMIT,
+            **command.kwargs,
+        )
+    )
+    try:
+        process = await asyncio.shield(spawn)
+    except asyncio.CancelledError:
+        # a command cancelled while starting is stopped once it has started
+        process = await spawn
+        stop(process)
+        await process.wait()
+        raise
+
+    async def read_lines():
+        async for line in process.stdout:
+            line = line.decode(errors="replace").rstrip()
+            logger.info(prefix + line)
+            lines.append(line)
+            reason = next(
+                filter(None, (matcher(line) for matcher in command.matchers)), None
+            )
+            if reason:
+                return reason
+        return None
+
+    try:
+        aborted = await asyncio.wait_for(read_lines(), command.timeout)
+    except asyncio.TimeoutError:
+        aborted = f"timed out after {command.timeout}s"
+    except asyncio.CancelledError:
+        stop(process)
+        await process.wait()
+        raise
+    if aborted:
+        logger.error(f"{prefix}Stopping command, {aborted}")
+        stop(process)
+    returncode = await process.wait()
+
+    result = CommandResult(
+        command.command, returncode, list(lines), time.monotonic() - start, aborted
+    )
+    log_result(result, prefix)
+    return result
+
+
+async def run_commands(commands, limit, fail_fast):
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run_limited(command):
+        async with semaphore:
+            return await run_async(command)
+
+    tasks = {
+        command.name: asyncio.create_task(run_limited(command)) for command in commands
+    }
+    pending = set(tasks.values())
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        if fail_fast and pending and not all(task.result().ok for task in done):
+            logger.error(f"Cancelling {len(pending)} commands after a failure")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            break
+
+    return {
+        name: (
+            CommandResult(command.command, None, [], 0, aborted="cancelled")
+            if task.cancelled()
+            else task.result()
+        )
+        for command, (name, task) in zip(commands, tasks.items())
+    }
+
+
+# runs several commands at once, at most limit at a time, returning their results by
+# name
+# with fail_fast the first failure stops the other commands, with check any failure
+# raises CommandFailed once they are all done
+def run_all(commands, limit=4, fail_fast=False, check=False):
+    results = asyncio.run(run_commands(commands, limit, fail_fast))
+    if check:
+        for result in results.values():
+            if not result.ok:
+                raise CommandFailed(result)
+    return results
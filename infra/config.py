@@ -9,15 +9,17 @@ import coloredlogs
 format_string = (
     "%(levelname)s: %(asctime)s %(funcName)s() %(name)s:%(lineno)s %(message)s"
 )
+
+
+# log files roll over at 5MB, keeping the last 7
+def log_file_handler(path):
+    return handlers.RotatingFileHandler(path, maxBytes=(1048576 * 5), backupCount=7)
+
+
 logging.basicConfig(
     level=logging.INFO,
     format=format_string,
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        handlers.RotatingFileHandler(
-            "logs/infra.log", maxBytes=(1048576 * 5), backupCount=7
-        ),
-    ],
+    handlers=[logging.StreamHandler(sys.stdout), log_file_handler("logs/infra.log")],
 )
 coloredlogs.install(
     level="INFO",
@@ -25,6 +27,34 @@ coloredlogs.install(
 )
 
 
+# the record factory before any prefix, which a worker process reused for another env
+# wraps again instead of the previous env's
+default_record_factory = logging.getLogRecordFactory()
+
+
+# prefixes every log record emitted by this process, e.g. with the env of a worker
+def set_log_prefix(prefix):
+    def prefixed_record_factory(*args, **kwargs):
+        record = default_record_factory(*args, **kwargs)
+        record.msg = f"[{prefix}] {record.msg}"
+        return record
+
+    logging.setLogRecordFactory(prefixed_record_factory)
+
+
+# logs this process to its own file, e.g. a worker to logs/infra-dev.log, instead of the
+# file it inherited, as a file rotated by more than one process loses records
+def set_log_file(path):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, handlers.RotatingFileHandler):
+            root.removeHandler(handler)
+            handler.close()
+    handler = log_file_handler(path)
+    handler.setFormatter(logging.Formatter(format_string))
+    root.addHandler(handler)
+
+
 def load_infra_config(org, env):
     sys.path.append(os.path.join(os.path.dirname(__file__), "..", "infra-config"))
     shared_infra = getattr(__import__("shared", fromlist=["infra"]), "infra")
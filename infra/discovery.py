@@ -0,0 +1,107 @@
+import logging
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# lookups of AWS resources by name or tag for the StackManager
+# each lookup pages through results, filters server side where the API allows it and
+# stops at the first match, so it never depends on a resource being on the first page
+
+
+# get the ID of the rest API with the given name
+def find_rest_api_id(api_gateway_client, name):
+    paginator = api_gateway_client.get_paginator("get_rest_apis")
+    for page in paginator.paginate(PaginationConfig={"PageSize": 500}):
+        for api in page["items"]:
+            if api["name"] == name:
+                return api["id"]
+    return None
+
+
+# get the ARN of the ACM certificate for the given domain
+def find_certificate_arn(acm_client, domain):
+    paginator = acm_client.get_paginator("list_certificates")
+    for page in paginator.paginate(PaginationConfig={"PageSize": 1000}):
+        for certificate in page["CertificateSummaryList"]:
+            if certificate["DomainName"] == domain:
+                return certificate["CertificateArn"]
+    return None
+
+
+# get the ARN of the latest published version of a lambda function
+def find_latest_function_version_arn(lambda_client, function_name):
+    try:
+        lambda_client.get_function(FunctionName=function_name)
+    except lambda_client.exceptions.ResourceNotFoundException:
+        logger.warning(f"{function_name} lambda function not found.")
+        return None
+
+    latest_version = None
+    paginator = lambda_client.get_paginator("list_versions_by_function")
+    for page in paginator.paginate(FunctionName=function_name):
+        for version in page["Versions"]:
+            if version["Version"] == "$LATEST":
+                continue
+            if latest_version is None or int(version["Version"]) > int(
+                latest_version["Version"]
+            ):
+                latest_version = version
+    if latest_version is None:
+        logger.warning(f"{function_name} lambda function has no published versions.")
+        return None
+    return latest_version["FunctionArn"]
+
+
+# get the IDs of the subnets created by cloudformation with a logical ID prefix
+def find_subnet_ids(ec2_client, logical_id_prefix):
+    subnet_ids = []
+    paginator = ec2_client.get_paginator("describe_subnets")
+    for page in paginator.paginate(
+        Filters=[
+            dict(
+                Name="tag:aws:cloudformation:logical-id",
+                Values=[f"{logical_id_prefix}*"],
+            )
+        ]
+    ):
+        subnet_ids.extend(subnet["SubnetId"] for subnet in page["Subnets"])
+    return subnet_ids
+
+
+# get the ID of the cloudfront distribution a cloudformation stack created
+def find_stack_distribution_id(cloudformation_client, stack):
+    paginator = cloudformation_client.get_paginator("list_stack_resources")
+    try:
+        for page in paginator.paginate(StackName=stack):
+            for resource in page["StackResourceSummaries"]:
+                if resource["ResourceType"] == "AWS::CloudFront::Distribution":
+                    return resource["PhysicalResourceId"]
+    except ClientError as e:
+        if "does not exist" in str(e):
+            return None
+        raise
+    return None
+
+
+# index of cloudfront distributions by each alias and by comment
+# built with one paginated listing and then shared by every lookup of a run
+class DistributionIndex:
+    def __init__(self, cloudfront_client):
+        self.by_alias = {}
+        self.by_comment = {}
+        paginator = cloudfront_client.get_paginator("list_distributions")
+        for page in paginator.paginate():
+            for distribution in page["DistributionList"].get("Items", []):
+                for alias in distribution["Aliases"].get("Items", []):
+                    self.by_alias[alias] = distribution["Id"]
+                comment = distribution.get("Comment")
+                if comment:
+                    self.by_comment[comment] = distribution["Id"]
+
+    # get the ID of the first distribution matching the alias or comment
+    def find(self, alias=None, comment=None):
+        for index, key in [(self.by_alias, alias), (self.by_comment, comment)]:
+            if key and key in index:
+                return index[key]
+        return None
@@ -0,0 +1,184 @@
+import logging
+import math
+import os
+import sqlite3
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+HISTORY_PATH = os.path.join(os.path.dirname(__file__), ".cache", "history.sqlite3")
+# the step recorded for the whole of a run
+TOTAL = "total"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    org TEXT NOT NULL,
+    env TEXT NOT NULL,
+    stack TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    duration REAL NOT NULL,
+    succeeded INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    category TEXT NOT NULL,
+    name TEXT NOT NULL,
+    calls INTEGER NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_key ON runs (org, env, stack, mode, started_at);
+"""
+
+
+# nearest rank percentile of a non empty list of values
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+# the total duration and number of calls of each step in trace events, by category
+# and name, e.g. ("command", "npm run build-demo")
+def get_step_durations(events):
+    steps = defaultdict(lambda: [0, 0.0])
+    for event in events:
+        if event["ph"] == "X":
+            step = steps[(event["cat"], event["name"])]
+            step[0] += 1
+            step[1] += event["dur"] / 1e6
+    return steps
+
+
+# the durations of a step over several runs, with the latest run's apart so it can be
+# checked against the baseline of the runs before it
+class StepStats:
+    def __init__(self, category, name, previous, latest):
+        self.category = category
+        self.name = name
+        durations = previous + ([] if latest is None else [latest])
+        self.runs = len(durations)
+        self.p50 = percentile(durations, 50)
+        self.p95 = percentile(durations, 95)
+        self.latest = latest
+        self.baseline = percentile(previous, 50) if previous else None
+
+    def regressed(self, threshold, min_seconds):
+        return (
+            self.latest is not None
+            and self.baseline is not None
+            and self.latest > self.baseline * threshold
+            and self.latest - self.baseline >= min_seconds
+        )
+
+
+# per step durations of past runs, keyed by org/env/stack/mode, see infra.py stats
+class History:
+    def __init__(self, path=HISTORY_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # parallel env workers write to the same database
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.executescript(SCHEMA)
+
+    def record(self, org, env, stack, mode, started_at, duration, succeeded, events):
+        with self.connection:
+            run_id = self.connection.execute(
+                "INSERT INTO runs (started_at, org, env, stack, mode, duration, "
+                "succeeded) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (started_at, org, env, stack, mode, duration, succeeded),
+            ).lastrowid
+            self.connection.executemany(
+                "INSERT INTO steps (run_id, category, name, calls, duration) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (run_id, category, name, calls, step_duration)
+                    for (category, name), (calls, step_duration) in get_step_durations(
+                        events
+                    ).items()
+                ],
+            )
+
+    # the keys of the runs since a time, optionally only those with the given orgs,
+    # envs, stacks or modes, e.g. env=["dev", "staging"]
+    def get_run_keys(self, since, **key):
+        conditions = "".join(
+            f" AND {column} IN ({', '.join('?' * len(values))})"
+            for column, values in key.items()
+        )
+        return self.connection.execute(
+            "SELECT DISTINCT org, env, stack, mode FROM runs "
+            f"WHERE succeeded AND started_at >= ?{conditions} "
+            "ORDER BY org, env, stack, mode",
+            (since, *(value for values in key.values() for value in values)),
+        ).fetchall()
+
+    # statistics of the steps of the successful runs with a key since a time
+    def get_step_stats(self, org, env, stack, mode, since):
+        rows = self.connection.execute(
+            "SELECT runs.id, 'run', ?, runs.duration FROM runs "
+            "WHERE org = ? AND env = ? AND stack = ? AND mode = ? AND succeeded "
+            "AND started_at >= ? "
+            "UNION ALL "
+            "SELECT runs.id, steps.category, steps.name, steps.duration FROM steps "
+            "JOIN runs ON steps.run_id = runs.id "
+            "WHERE org = ? AND env = ? AND stack = ? AND mode = ? AND succeeded "
+            "AND started_at >= ?",
+            (TOTAL, org, env, stack, mode, since, org, env, stack, mode, since),
+        ).fetchall()
+        latest_run = max(row[0] for row in rows)
+        previous = defaultdict(list)
+        latest = {}
+        for run_id, category, name, duration in rows:
+            if run_id == latest_run:
+                latest[(category, name)] = duration
+            else:
+                previous[(category, name)].append(duration)
+        return [
+            StepStats(
+                category, name, previous[(category, name)], latest.get((category, name))
+            )
+            for category, name in sorted(set(previous) | set(latest))
+        ]
+
+
+def record_run(org, env, stack, mode, started_at, duration, succeeded, events):
+    try:
+        History().record(
+            org, env, stack or "all", mode, started_at, duration, succeeded, events
+        )
+    except sqlite3.Error:
+        # the history is nice to have, a run never fails because of it
+        logger.warning("Could not record the run in the timing history", exc_info=True)
+
+
+# logs p50/p95 per step of the runs in the last days, flagging steps whose latest
+# duration is more than threshold times the p50 of the runs before and slower by at
+# least min_seconds
+# steps that never take min_duration are left out
+def report(days=30, threshold=1.5, min_seconds=5, min_duration=1, **key):
+    history = History()
+    since = time.time() - days * 24 * 60 * 60
+    regressions = []
+    for org, env, stack, mode in history.get_run_keys(since, **key):
+        logger.info(f"Steps of [{mode}] [{stack}] for org [{org}], env [{env}]")
+        logger.info(f"{'step':<60} {'runs':>5} {'p50':>8} {'p95':>8} {'latest':>8}")
+        for stats in history.get_step_stats(org, env, stack, mode, since):
+            if stats.p95 < min_duration:
+                continue
+            regressed = stats.regressed(threshold, min_seconds)
+            latest = "-" if stats.latest is None else f"{stats.latest:.1f}s"
+            logger.info(
+                f"{stats.category + ' ' + stats.name:<60.60} {stats.runs:>5} "
+                f"{stats.p50:>7.1f}s {stats.p95:>7.1f}s {latest:>8}"
+                + ("  REGRESSED" if regressed else "")
+            )
+            if regressed:
+                regressions.append((org, env, stack, mode, stats))
+    for org, env, stack, mode, stats in regressions:
+        logger.warning(
+            f"[{mode}] [{stack}] [{org}] [{env}] {stats.category} {stats.name} took "
+            f"{stats.latest:.1f}s in the latest run, against a p50 of "
+            f"{stats.baseline:.1f}s before"
+        )
+    return regressions
@@ -1,9 +1,20 @@
 import logging
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pprint import pformat
 
 import click
 
-from config import load_infra_config, load_server_private_config
+import history
+from config import (
+    load_infra_config,
+    load_server_private_config,
+    set_log_file,
+    set_log_prefix,
+)
+from ratelimit import rate_limiter
+from tracing import get_trace_path, span, tracer
 from utils import StackManager
 
 logger = logging.getLogger(__name__)
@@ -13,7 +24,7 @@ logger = logging.getLogger(__name__)
 @click.argument(
     "mode",
     required=True,
-    type=click.Choice(["setup", "teardown", "deploy"]),
+    type=click.Choice(["setup", "teardown", "deploy", "promote", "stats"]),
 )
 @click.option(
     "-o",
@@ -39,6 +50,7 @@ logger = logging.getLogger(__name__)
         [
             "certificate",
             "org",
+            "shared",
             "server",
             "clients-no-aliases",
             "clients",
@@ -51,70 +63,322 @@ logger = logging.getLogger(__name__)
         ]
     ),
 )
-def infra(mode, org, env, stack):
+@click.option(
+    "-p",
+    "--parallel",
+    help="Number of envs to run concurrently, each in its own worker process",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--refresh",
+    help="Ignore identifiers cached by previous runs and discover them again",
+    is_flag=True,
+)
+@click.option(
+    "--wait-for-invalidation",
+    help="Wait for cloudfront invalidations to complete after deploying frontends",
+    is_flag=True,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    help="Number of independent stacks and steps of an env to run concurrently",
+    default=4,
+    show_default=True,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--keep-going",
+    help="Carry on with steps that don't depend on a failed step",
+    is_flag=True,
+)
+@click.option(
+    "--force-deploy",
+    help="Deploy stacks even when their deployed template is unchanged",
+    is_flag=True,
+)
+@click.option(
+    "--expire-buckets",
+    help="On teardown, have S3 expire the objects of buckets that aren't empty "
+    "instead of deleting them, for buckets too large to empty inline",
+    is_flag=True,
+)
+@click.option(
+    "--days",
+    help="Number of days of past runs the stats mode reports on",
+    default=30,
+    show_default=True,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--engine",
+    help="Deploy stacks with the cdk CLI, or natively through CloudFormation change sets",
+    default="cdk",
+    show_default=True,
+    type=click.Choice(["cdk", "native"]),
+)
+def infra(
+    mode,
+    org,
+    env,
+    stack,
+    parallel,
+    refresh,
+    wait_for_invalidation,
+    jobs,
+    keep_going,
+    force_deploy,
+    engine,
+    expire_buckets,
+    days,
+):
+    # report on past runs instead of running anything
+    if mode == "stats":
+        key = {"org": [org]}
+        if env:
+            key["env"] = env
+        if stack:
+            key["stack"] = [stack]
+        history.report(days, **key)
+        return
+
     # set an unused dev env for stacks that are env independent
-    if env == () and stack in ["certificate", "org", "vpc"]:
+    if env == () and stack in ["certificate", "org", "shared", "vpc"]:
         env = ("dev",)
     else:
         logger.info("Please specify an environment for this stack")
 
+    # options passed through to every StackManager
+    options = dict(
+        refresh=refresh,
+        wait_for_invalidations=wait_for_invalidation,
+        jobs=jobs,
+        keep_going=keep_going,
+        force_deploy=force_deploy,
+        engine=engine,
+        expire_buckets=expire_buckets,
+    )
+
+    # spans recorded in the history of every env's run, e.g. the release build that
+    # promote runs once for all of them
+    shared_events = []
+
     logger.info(f"Running mode [{mode}] for stack [{stack}]")
-    for en in env:
-        logger.info(f"Loading config for org [{org}], env [{en}]")
-
-        # load infra and server private config
-        infra_config = load_infra_config(org, en)
-        logger.info("INFRA CONFIG\n" + pformat(infra_config))
-        server_private_config = load_server_private_config(org, en)
-        logger.info("SERVER PRIVATE CONFIG\n" + pformat(server_private_config))
-
-        stack_manager = StackManager(infra_config, server_private_config)
-
-        # # testing code
-        # stack_manager.test()
-        # return
-
-        if mode == "setup":
-            if stack == "certificate":
-                stack_manager.set_up_certificate()
-            elif stack == "org":
-                stack_manager.set_up_org()
-            elif stack == "clients":
-                stack_manager.set_up_clients(add_aliases="yes")
-            elif stack == "env-no-aliases":
-                stack_manager.set_up_environment()
-            elif stack == "env":
-                stack_manager.set_up_environment(add_aliases="yes")
-            elif stack in ["vpc"]:
-                stack_manager.deploy_stack(f"sano-{org}-{stack}-stack")
-            elif stack in ["backend", "portal", "admin"]:
-                stack_manager.deploy_stack(
-                    f"sano-{org}-{en}-{stack}-stack", add_aliases="yes"
+    try:
+        with span(f"{mode} {stack or 'all'}", "run"):
+            if mode == "promote":
+                if stack not in [None, "portal", "admin"]:
+                    raise click.BadParameter(
+                        "only portal and admin can be promoted", param_hint="stack"
+                    )
+                if not env:
+                    raise click.BadParameter(
+                        "promote needs at least one env", param_hint="env"
+                    )
+                # every env promotes the artifacts built here, instead of building again
+                mark = tracer.mark()
+                options["release_artifacts"] = build_release_artifacts(org, env[0], stack)
+                shared_events = tracer.events_since(mark)
+            if parallel > 1 and len(env) > 1:
+                # env workers build in the same frontend directories, so the frontends
+                # are installed once before they start
+                install_frontends(org, env[0], get_env_frontends(mode, stack))
+                run_envs_in_parallel(
+                    mode, org, env, stack, options, parallel, shared_events
                 )
+            else:
+                for en in env:
+                    run_recorded_env(mode, org, en, stack, options, shared_events)
+    finally:
+        # worker processes report on their envs themselves
+        rate_limiter.log_metrics()
+        tracer.export(get_trace_path(org, mode))
 
-        if mode == "teardown":
-            if stack == "certificate":
-                stack_manager.tear_down_certificate()
-            elif stack == "org":
-                stack_manager.tear_down_org()
-            elif stack == "env":
-                stack_manager.tear_down_environment()
-            elif stack in ["vpc"]:
-                stack_manager.destroy_stack(f"sano-{org}-{stack}-stack")
-            elif stack in ["backend", "portal", "admin"]:
-                stack_manager.destroy_stack(f"sano-{org}-{en}-{stack}-stack")
-
-        if mode == "deploy":
-            if stack is None:
-                stack_manager.deploy_server()
-                stack_manager.deploy_portal()
-                stack_manager.deploy_admin()
-            elif stack == "backend":
-                stack_manager.deploy_server()
-            elif stack == "portal":
+
+# runs each env in its own worker process and reports per-env results at the end
+def run_envs_in_parallel(mode, org, env, stack, options, parallel, shared_events=()):
+    logger.info(f"Running envs {list(env)} with {parallel} workers")
+    options = dict(options, rate_limit_shares=min(parallel, len(env)))
+    results = {}
+    with ProcessPoolExecutor(max_workers=parallel) as executor:
+        futures = {
+            executor.submit(
+                run_env_worker, mode, org, en, stack, options, shared_events
+            ): en
+            for en in env
+        }
+        for future in as_completed(futures):
+            en = futures[future]
+            try:
+                future.result()
+                results[en] = None
+            except Exception as e:
+                # the worker logged the traceback
+                logger.error(f"Env [{en}] failed: {e}")
+                results[en] = e
+
+    for en in env:
+        if results[en] is None:
+            logger.info(f"Env [{en}]: SUCCEEDED")
+        else:
+            logger.error(f"Env [{en}]: FAILED ({results[en]!r})")
+    if any(result is not None for result in results.values()):
+        sys.exit(1)
+
+
+# builds each release artifact once up front, so every env promotes the same bits,
+# returning the cached artifact of each frontend
+def build_release_artifacts(org, en, stack):
+    infra_config = load_infra_config(org, en)
+    server_private_config = load_server_private_config(org, en)
+    stack_manager = StackManager(infra_config, server_private_config)
+    return stack_manager.build_artifacts(get_frontends(stack))
+
+
+def get_frontends(stack):
+    return ["portal", "admin"] if stack is None else [stack]
+
+
+# the frontends a mode builds in each env
+def get_env_frontends(mode, stack):
+    if mode == "deploy" and stack in [None, "portal", "admin"]:
+        return get_frontends(stack)
+    if mode == "setup" and stack in [
+        "clients-no-aliases",
+        "clients",
+        "env-no-aliases",
+        "env",
+    ]:
+        return ["portal", "admin"]
+    return []
+
+
+def install_frontends(org, en, names):
+    if not names:
+        return
+    infra_config = load_infra_config(org, en)
+    server_private_config = load_server_private_config(org, en)
+    stack_manager = StackManager(infra_config, server_private_config)
+    failed = stack_manager.install_frontends(
+        {name: infra_config[f"{name}_dir"] for name in names}, fail_fast=True
+    )
+    if failed:
+        raise RuntimeError(f"Installing {', '.join(failed)} failed")
+
+
+def run_env_worker(mode, org, en, stack, options, shared_events=()):
+    set_log_prefix(en)
+    set_log_file(f"logs/infra-{en}.log")
+    # the spans and rate limits of the parent process are its own
+    tracer.clear()
+    rate_limiter.clear()
+    try:
+        run_recorded_env(mode, org, en, stack, options, shared_events)
+    except Exception as e:
+        # exceptions are pickled back to the parent process, which not all of them (or
+        # the exceptions they hold) survive, so it gets a plain one with the traceback
+        # logged here
+        logger.exception(f"Env [{en}] failed")
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+    finally:
+        rate_limiter.log_metrics()
+        tracer.export(get_trace_path(org, mode, en))
+
+
+# runs an env in its own span and records the time its steps took in the history,
+# along with the steps shared by every env of the run
+def run_recorded_env(mode, org, en, stack, options, shared_events=()):
+    mark = tracer.mark()
+    started_at = time.time()
+    start = time.monotonic()
+    succeeded = False
+    try:
+        with span(f"env {en}", "env"):
+            run_env(mode, org, en, stack, options)
+        succeeded = True
+    finally:
+        history.record_run(
+            org,
+            en,
+            stack,
+            mode,
+            started_at,
+            time.monotonic() - start,
+            succeeded,
+            list(shared_events) + tracer.events_since(mark),
+        )
+
+
+def run_env(mode, org, en, stack, options):
+    logger.info(f"Loading config for org [{org}], env [{en}]")
+
+    # load infra and server private config
+    infra_config = load_infra_config(org, en)
+    logger.info("INFRA CONFIG\n" + pformat(infra_config))
+    server_private_config = load_server_private_config(org, en)
+    logger.info("SERVER PRIVATE CONFIG\n" + pformat(server_private_config))
+
+    stack_manager = StackManager(infra_config, server_private_config, **options)
+
+    # # testing code
+    # stack_manager.test()
+    # return
+
+    if mode == "setup":
+        if stack == "certificate":
+            stack_manager.set_up_certificate()
+        elif stack == "org":
+            stack_manager.set_up_org()
+        elif stack == "shared":
+            stack_manager.set_up_shared()
+        elif stack == "clients-no-aliases":
+            stack_manager.set_up_clients()
+        elif stack == "clients":
+            stack_manager.set_up_clients(add_aliases="yes")
+        elif stack == "env-no-aliases":
+            stack_manager.set_up_environment()
+        elif stack == "env":
+            stack_manager.set_up_environment(add_aliases="yes")
+        elif stack in ["vpc"]:
+            stack_manager.deploy_stack(f"sano-{org}-{stack}-stack")
+        elif stack in ["backend", "portal", "admin"]:
+            stack_manager.deploy_stack(
+                f"sano-{org}-{en}-{stack}-stack", add_aliases="yes"
+            )
+
+    if mode == "teardown":
+        if stack == "certificate":
+            stack_manager.tear_down_certificate()
+        elif stack == "org":
+            stack_manager.tear_down_org()
+        elif stack == "shared":
+            stack_manager.tear_down_shared()
+        elif stack == "env":
+            stack_manager.tear_down_environment()
+        elif stack in ["vpc"]:
+            stack_manager.destroy_stack(f"sano-{org}-{stack}-stack")
+        elif stack in ["backend", "portal", "admin"]:
+            stack_manager.destroy_stack(f"sano-{org}-{en}-{stack}-stack")
+
+    if mode == "deploy":
+        if stack is None:
+            stack_manager.deploy_server()
+            with stack_manager.batched_invalidations():
                 stack_manager.deploy_portal()
-            elif stack == "admin":
                 stack_manager.deploy_admin()
+        elif stack == "backend":
+            stack_manager.deploy_server()
+        elif stack == "portal":
+            stack_manager.deploy_portal()
+        elif stack == "admin":
+            stack_manager.deploy_admin()
+
+    if mode == "promote":
+        with stack_manager.batched_invalidations():
+            for name in get_frontends(stack):
+                stack_manager.promote_frontend(name)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,68 @@
+import logging
+import os
+import time
+from urllib.parse import quote
+
+from polling import wait_until
+from sync import ENTRY_DOCUMENTS
+
+logger = logging.getLogger(__name__)
+
+# above this many paths a single wildcard is cheaper than listing them all
+DEFAULT_PATH_LIMIT = 20
+
+
+# get the paths to invalidate for keys overwritten in a bucket (see SyncResult),
+# falling back to a wildcard when there are more than the limit
+# the distributions serve their entry document for every path S3 has no object for
+# (e.g. SPA deep links), and cache those error responses under each path, so a new
+# entry document needs the wildcard too
+def invalidation_paths(overwritten_keys, limit=DEFAULT_PATH_LIMIT):
+    paths = set()
+    for key in overwritten_keys:
+        if os.path.basename(key) in ENTRY_DOCUMENTS:
+            return ["/*"]
+        paths.add("/" + quote(key))
+    if len(paths) > limit:
+        return ["/*"]
+    return sorted(paths)
+
+
+# creates one invalidation per distribution, returning their IDs by distribution
+def create_invalidations(cloudfront_client, paths_by_distribution):
+    invalidation_ids = {}
+    for distribution_id, paths in paths_by_distribution.items():
+        logger.info(f"Invalidating {paths} on distribution {distribution_id}")
+        response = cloudfront_client.create_invalidation(
+            DistributionId=distribution_id,
+            InvalidationBatch={
+                "Paths": {"Quantity": len(paths), "Items": paths},
+                "CallerReference": f"{distribution_id}-{time.time()}",
+            },
+        )
+        invalidation_ids[distribution_id] = response["Invalidation"]["Id"]
+    return invalidation_ids
+
+
+def wait_for_invalidations(cloudfront_client, invalidation_ids, timeout=1800):
+    def all_completed():
+        completed = [
+            distribution_id
+            for distribution_id, invalidation_id in invalidation_ids.items()
+            if cloudfront_client.get_invalidation(
+                DistributionId=distribution_id, Id=invalidation_id
+            )["Invalidation"]["Status"]
+            == "Completed"
+        ]
+        logger.info(
+            f"{len(completed)} of {len(invalidation_ids)} invalidations completed"
+        )
+        return len(completed) == len(invalidation_ids)
+
+    wait_until(
+        all_completed,
+        f"invalidations {list(invalidation_ids.values())} to complete",
+        timeout=timeout,
+        delay=10,
+        max_delay=60,
+    )
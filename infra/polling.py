@@ -0,0 +1,37 @@
+import logging
+from time import monotonic, sleep
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+# polls check() with exponential backoff until it returns something truthy, which is
+# returned, or raises a TimeoutError once the deadline has passed
+def wait_until(check, description, timeout=600, delay=2, max_delay=30, backoff=2):
+    with span(f"wait for {description}", "wait"):
+        return poll(check, description, timeout, delay, max_delay, backoff)
+
+
+def poll(check, description, timeout, delay, max_delay, backoff):
+    logger.info(f"Waiting for {description}")
+    start = monotonic()
+    deadline = start + timeout
+    attempts = 0
+    while True:
+        attempts += 1
+        result = check()
+        now = monotonic()
+        if result:
+            logger.info(
+                f"Done waiting for {description} after {now - start:.1f}s "
+                f"({attempts} checks)"
+            )
+            return result
+        if now >= deadline:
+            raise TimeoutError(
+                f"Gave up waiting for {description} after {now - start:.1f}s "
+                f"({attempts} checks)"
+            )
+        sleep(min(delay, deadline - now))
+        delay = min(delay * backoff, max_delay)
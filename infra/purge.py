@@ -0,0 +1,139 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# the most keys delete_objects takes at once
+DELETE_BATCH_SIZE = 1000
+MB = 1024 * 1024
+
+
+class PurgeResult:
+    def __init__(self):
+        self.objects = 0
+        self.bytes = 0
+        self.duration = 0.0
+
+    def log(self, bucket):
+        rate = self.objects / self.duration if self.duration else 0
+        logger.info(
+            f"Removed {self.objects} object versions ({self.bytes / MB:.1f}MB) from "
+            f"{bucket} in {self.duration:.1f}s ({rate:.0f} objects/s)"
+        )
+
+
+# yields the versions and delete markers of a bucket in batches of up to 1000, with
+# the total size of each batch
+def list_version_batches(s3_client, bucket):
+    paginator = s3_client.get_paginator("list_object_versions")
+    for page in paginator.paginate(
+        Bucket=bucket, PaginationConfig={"PageSize": DELETE_BATCH_SIZE}
+    ):
+        entries = page.get("Versions", []) + page.get("DeleteMarkers", [])
+        if entries:
+            yield (
+                [
+                    {"Key": entry["Key"], "VersionId": entry["VersionId"]}
+                    for entry in entries
+                ],
+                sum(entry.get("Size", 0) for entry in entries),
+            )
+
+
+# deletes a batch of object versions, retrying the ones that fail with backoff
+def delete_batch(s3_client, bucket, objects, attempts=5, delay=1):
+    for attempt in range(attempts):
+        response = s3_client.delete_objects(
+            Bucket=bucket, Delete={"Objects": objects, "Quiet": True}
+        )
+        errors = response.get("Errors", [])
+        if not errors:
+            return
+        failed = {(error["Key"], error.get("VersionId")) for error in errors}
+        objects = [
+            entry for entry in objects if (entry["Key"], entry["VersionId"]) in failed
+        ]
+        logger.warning(
+            f"Deleting {len(objects)} objects from {bucket} failed "
+            f"({errors[0]['Code']}: {errors[0]['Message']}), retrying"
+        )
+        time.sleep(delay * 2**attempt)
+    raise RuntimeError(
+        f"Could not delete {len(objects)} objects from {bucket}, e.g. {errors[:3]}"
+    )
+
+
+# deletes every version and delete marker in a bucket, with up to workers batches
+# being deleted while the next pages are listed
+def empty_bucket(s3_client, bucket, workers=8):
+    result = PurgeResult()
+    start = time.monotonic()
+    logger.info(f"Emptying {bucket}")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            running = {}
+            for objects, size in list_version_batches(s3_client, bucket):
+                # only list ahead as far as the workers can keep up
+                if len(running) >= 2 * workers:
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        future.result()
+                        count, size_deleted = running.pop(future)
+                        result.objects += count
+                        result.bytes += size_deleted
+                future = executor.submit(delete_batch, s3_client, bucket, objects)
+                running[future] = (len(objects), size)
+            for future in running:
+                future.result()
+                count, size_deleted = running[future]
+                result.objects += count
+                result.bytes += size_deleted
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchBucket":
+            raise
+        logger.info(f"{bucket} does not exist")
+    result.duration = time.monotonic() - start
+    result.log(bucket)
+    return result
+
+
+def is_bucket_empty(s3_client, bucket):
+    try:
+        response = s3_client.list_object_versions(Bucket=bucket, MaxKeys=1)
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "NoSuchBucket":
+            return True
+        raise
+    return not (response.get("Versions") or response.get("DeleteMarkers"))
+
+
+# has S3 expire everything in a bucket in the background instead, for buckets too
+# large to empty inline
+# S3 applies lifecycle rules about once a day, so the bucket empties within a couple
+# of days
+def expire_bucket(s3_client, bucket):
+    s3_client.put_bucket_lifecycle_configuration(
+        Bucket=bucket,
+        LifecycleConfiguration={
+            "Rules": [
+                {
+                    "ID": "expire-everything",
+                    "Filter": {"Prefix": ""},
+                    "Status": "Enabled",
+                    "Expiration": {"Days": 1},
+                    "NoncurrentVersionExpiration": {"NoncurrentDays": 1},
+                    "AbortIncompleteMultipartUpload": {"DaysAfterInitiation": 1},
+                },
+                {
+                    "ID": "remove-expired-delete-markers",
+                    "Filter": {"Prefix": ""},
+                    "Status": "Enabled",
+                    "Expiration": {"ExpiredObjectDeleteMarker": True},
+                },
+            ]
+        },
+    )
+    logger.info(f"Set every object in {bucket} to expire")
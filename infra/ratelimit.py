@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# requests per second allowed to each service in each region of an account, which
+# orgs can override with "api_rate_limits"
+# None leaves a service unlimited, e.g. S3, whose data plane is limited per prefix
+DEFAULT_API_RATE_LIMITS = {
+    "default": 10,
+    "acm": 5,
+    "apigateway": 5,
+    "cloudformation": 5,
+    "cloudfront": 2,
+    "ec2": 20,
+    "lambda": 10,
+    "rds": 10,
+    "s3": None,
+}
+
+# error codes AWS answers with when a caller is over its rate
+THROTTLING_ERROR_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "SlowDown",
+    "PriorRequestNotComplete",
+}
+
+
+# hands out rate requests per second, allowing bursts of up to burst at once
+# callers reserve tokens ahead of time, so waiting callers go in turn instead of all
+# retrying at once
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.delayed_calls = 0
+        self.total_delay = 0.0
+        self.max_delay = 0.0
+        self.throttles = 0
+
+    # takes a token, returning how long the caller has to wait for it
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            delay = max(-self.tokens / self.rate, 0.0)
+            self.calls += 1
+            if delay:
+                self.delayed_calls += 1
+                self.total_delay += delay
+                self.max_delay = max(self.max_delay, delay)
+            return delay
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    # AWS throttled a call anyway, e.g. because of callers outside this process, so
+    # hold back until the bucket refills
+    def throttled(self):
+        with self.lock:
+            self.throttles += 1
+            self.tokens = min(self.tokens, 0)
+
+
+# a token bucket per account (profile), service and region that every AWS call of a
+# boto3 session waits on, see attach()
+class RateLimiter:
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def get_bucket(self, key, rate):
+        with self.lock:
+            if key not in self.buckets:
+                self.buckets[key] = TokenBucket(rate)
+            return self.buckets[key]
+
+    # limits the calls of the clients a session creates from now on to limits requests
+    # per second per service, of which this process gets one share of shares, e.g. one
+    # of several env workers running against the same account at once
+    def attach(self, session, account, limits=None, shares=1):
+        limits = dict(DEFAULT_API_RATE_LIMITS, **(limits or {}))
+
+        def get_bucket(event_name, region):
+            # e.g. before-call.api-gateway.GetRestApis
+            service = event_name.split(".")[1].replace("-", "")
+            rate = limits.get(service, limits["default"])
+            if rate is None:
+                return None
+            return self.get_bucket((account, service, region), rate / shares)
+
+        def before_call(event_name, context, **kwargs):
+            bucket = get_bucket(event_name, context.get("client_region"))
+            if bucket is None:
+                return
+            start = time.perf_counter()
+            if bucket.acquire():
+                tracer.add(
+                    f"rate limit {event_name.split('.', 1)[1]}",
+                    "throttle",
+                    start,
+                    time.perf_counter(),
+                )
+
+        def needs_retry(event_name, response, request_dict, **kwargs):
+            if response is None:
+                return None
+            error_code = response[1].get("Error", {}).get("Code")
+            if error_code in THROTTLING_ERROR_CODES:
+                bucket = get_bucket(
+                    event_name, request_dict["context"].get("client_region")
+                )
+                if bucket is not None:
+                    bucket.throttled()
+            # leave deciding on the retry to the retry handler
+            return None
+
+        session.events.register("before-call", before_call)
+        session.events.register("needs-retry", needs_retry)
+
+    # drops the buckets so far, e.g. those a forked worker process inherited
+    def clear(self):
+        with self.lock:
+            self.buckets = {}
+
+    def log_metrics(self):
+        with self.lock:
+            buckets = dict(self.buckets)
+        for (account, service, region), bucket in sorted(buckets.items()):
+            if not bucket.calls:
+                continue
+            logger.info(
+                f"{service} calls in {region} for {account}: {bucket.calls} at "
+                f"{bucket.rate:g}/s, {bucket.delayed_calls} queued for "
+                f"{bucket.total_delay:.1f}s in total (max {bucket.max_delay:.1f}s), "
+                f"{bucket.throttles} throttled"
+            )
+
+
+# the rate limiter of this process, shared by the StackManagers of its envs
+rate_limiter = RateLimiter()
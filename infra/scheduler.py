@@ -0,0 +1,111 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+# a stack or side step of the infrastructure, what sets it up and tears it down, and
+# the nodes it depends on
+# setup_only_deps are only needed to set the node up (e.g. a value read from another
+# stack), so unlike deps they do not hold up its teardown
+class Node:
+    def __init__(self, name, setup=None, teardown=None, deps=(), setup_only_deps=()):
+        self.name = name
+        self.setup = setup
+        self.teardown = teardown
+        self.deps = list(deps)
+        self.setup_only_deps = list(setup_only_deps)
+
+
+# the steps of a graph run that failed, by name, and the ones not run because of them
+# failed and skipped are its args, so it can be pickled back from a worker process
+class GraphFailed(Exception):
+    def __init__(self, failed, skipped):
+        super().__init__(failed, skipped)
+        self.failed = failed
+        self.skipped = skipped
+
+    def __str__(self):
+        return f"Steps failed: {sorted(self.failed)}" + (
+            f", not run: {sorted(self.skipped)}" if self.skipped else ""
+        )
+
+
+# get the dependencies of each selected node on the other selected nodes
+# setting up follows the dependencies, tearing down follows them in reverse
+def get_dependencies(nodes, selected, action):
+    dependencies = {name: set() for name in selected}
+    for name in selected:
+        node = nodes[name]
+        if action == "setup":
+            dependencies[name].update(
+                dep for dep in node.deps + node.setup_only_deps if dep in selected
+            )
+        else:
+            for dep in node.deps:
+                if dep in selected:
+                    dependencies[dep].add(name)
+    return dependencies
+
+
+def check_acyclic(dependencies):
+    remaining = {name: set(deps) for name, deps in dependencies.items()}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f"Dependency cycle between {sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+
+def run_node(node, action):
+    step = getattr(node, action)
+    if step is None:
+        return
+    logger.info(f"Starting {action} of {node.name}")
+    start = time.monotonic()
+    with span(f"{action} {node.name}", "graph"):
+        step()
+    logger.info(f"Finished {action} of {node.name} in {time.monotonic() - start:.1f}s")
+
+
+# runs the selected nodes of a graph, each as soon as the nodes it depends on are done,
+# with at most width running at once
+# with fail_fast no new nodes are started after a failure, otherwise only the nodes
+# depending on a failed node are skipped
+def run_graph(graph, selected, action="setup", width=4, fail_fast=True):
+    nodes = {node.name: node for node in graph}
+    dependencies = get_dependencies(nodes, selected, action)
+    check_acyclic(dependencies)
+
+    pending = [name for name in selected]
+    running = {}
+    done = set()
+    failed = {}
+    with ThreadPoolExecutor(max_workers=width) as executor:
+        while pending or running:
+            if not (failed and fail_fast):
+                for name in [n for n in pending if dependencies[n] <= done]:
+                    if len(running) >= width:
+                        break
+                    pending.remove(name)
+                    running[executor.submit(run_node, nodes[name], action)] = name
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                    done.add(name)
+                except Exception as e:
+                    logger.exception(f"Failed {action} of {name}")
+                    failed[name] = e
+
+    if failed:
+        raise GraphFailed(failed, pending)
@@ -0,0 +1,34 @@
+# the kinds of stacks app.py can build, and the kinds each needs built alongside it
+STACK_DEPENDENCIES = {
+    "certificate": [],
+    "vpc": [],
+    "backend": ["vpc"],
+    "portal": [],
+    "admin": [],
+}
+
+
+# get the given kinds of stacks and every kind they depend on
+def with_dependencies(kinds):
+    selected = set()
+    pending = list(kinds)
+    while pending:
+        kind = pending.pop()
+        if kind not in selected:
+            selected.add(kind)
+            pending.extend(STACK_DEPENDENCIES[kind])
+    return selected
+
+
+# get the given kinds of stacks and every kind that depends on them
+def with_dependents(kinds):
+    selected = set(kinds)
+    while True:
+        dependents = {
+            kind
+            for kind, dependencies in STACK_DEPENDENCIES.items()
+            if selected.intersection(dependencies)
+        }
+        if dependents <= selected:
+            return selected
+        selected |= dependents
@@ -16,6 +16,7 @@ class AdminStack(cdk.Stack):
         api_gateway_url,
         certificate_arn,
         add_aliases,
+        lifecycle_configuration,
         **kwargs,
     ) -> None:
         super().__init__(scope, id, **kwargs)
@@ -46,6 +47,11 @@ class AdminStack(cdk.Stack):
             ),
         )
 
+        # see stacks/lifecycle.py
+        admin_s3_bucket.add_property_override(
+            "LifecycleConfiguration", lifecycle_configuration
+        )
+
         id = f"{SOE}-admin-s3-bucket-policy"
         s3.CfnBucketPolicy(
             self,
@@ -117,7 +123,9 @@ class AdminStack(cdk.Stack):
                         query_string=True,
                         query_string_cache_keys=["must-put"],
                     ),
-                    max_ttl=0,
+                    # cache for as long as each object's Cache-Control allows, up to the
+                    # year of fingerprinted bundles, and not at all without one
+                    max_ttl=31536000,
                     min_ttl=0,
                     smooth_streaming=False,
                     target_origin_id=s3_bucket_origin_id,
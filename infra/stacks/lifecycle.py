@@ -0,0 +1,30 @@
+# the lifecycle configuration of a versioned frontend bucket, where every deploy leaves
+# noncurrent versions and delete markers behind, so listing it stays as fast over the
+# lifetime of an env
+# raw CloudFormation, as aws-cdk.core 1.112 predates NewerNoncurrentVersions
+def get_lifecycle_configuration(
+    noncurrent_version_expiration_days=None,
+    noncurrent_versions_to_retain=None,
+    abort_incomplete_multipart_upload_days=None,
+):
+    rule = {
+        "Id": "expire-noncurrent-versions",
+        "Status": "Enabled",
+        # delete markers left without any versions behind them
+        "ExpiredObjectDeleteMarker": True,
+    }
+    if noncurrent_version_expiration_days or noncurrent_versions_to_retain:
+        # versions beyond the ones retained expire a day after they become noncurrent
+        # when no number of days is given
+        rule["NoncurrentVersionExpiration"] = {
+            "NoncurrentDays": noncurrent_version_expiration_days or 1
+        }
+        if noncurrent_versions_to_retain:
+            rule["NoncurrentVersionExpiration"][
+                "NewerNoncurrentVersions"
+            ] = noncurrent_versions_to_retain
+    if abort_incomplete_multipart_upload_days:
+        rule["AbortIncompleteMultipartUpload"] = {
+            "DaysAfterInitiation": abort_incomplete_multipart_upload_days
+        }
+    return {"Rules": [rule]}
@@ -17,6 +17,7 @@ class PortalStack(cdk.Stack):
         certificate_arn,
         redirect_lambda_arn,
         add_aliases,
+        lifecycle_configuration,
         **kwargs,
     ) -> None:
         super().__init__(scope, id, **kwargs)
@@ -48,6 +49,11 @@ class PortalStack(cdk.Stack):
             ),
         )
 
+        # see stacks/lifecycle.py
+        portal_s3_bucket.add_property_override(
+            "LifecycleConfiguration", lifecycle_configuration
+        )
+
         id = f"{SOE}-portal-s3-bucket-policy"
         s3.CfnBucketPolicy(
             self,
@@ -134,7 +140,9 @@ class PortalStack(cdk.Stack):
                             lambda_function_arn=redirect_lambda_arn,
                         )
                     ],
-                    max_ttl=0,
+                    # cache for as long as each object's Cache-Control allows, up to the
+                    # year of fingerprinted bundles, and not at all without one
+                    max_ttl=31536000,
                     min_ttl=0,
                     smooth_streaming=False,
                     target_origin_id=s3_bucket_origin_id,
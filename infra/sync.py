@@ -0,0 +1,179 @@
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+
+from asset_policy import AssetPolicy, compress
+from transfer import TransferEngine
+
+logger = logging.getLogger(__name__)
+
+# records the ETag and digest of every object synced by the last sync of a bucket from
+# this checkout, kept locally as a bucket serving a frontend is publicly readable
+MANIFEST_DIR = os.path.join(os.path.dirname(__file__), ".cache", "sync")
+# documents that reference the other assets, uploaded last so that they never point
+# at assets which are not live yet
+ENTRY_DOCUMENTS = ["index.html", "app.html"]
+
+
+# a local file and the key and upload arguments it is synced with
+# precompressed files keep their compressed body in memory, others are read from disk
+class Asset:
+    def __init__(self, key, path, extra_args, encoding=None):
+        self.key = key
+        self.path = path
+        self.extra_args = extra_args
+        self.body = None
+        with open(path, "rb") as fp:
+            content = fp.read()
+        if encoding is not None:
+            compressed = compress(content)
+            if len(compressed) < len(content):
+                self.body = content = compressed
+                self.extra_args["ContentEncoding"] = encoding
+        self.md5 = hashlib.md5(content).hexdigest()
+
+    # what to upload, the file's path or its precompressed body
+    @property
+    def source(self):
+        return self.path if self.body is None else self.body
+
+    # changes whenever the content or the upload arguments change
+    @property
+    def digest(self):
+        signature = self.md5 + json.dumps(self.extra_args, sort_keys=True)
+        return hashlib.md5(signature.encode()).hexdigest()
+
+    @property
+    def is_entry_document(self):
+        return os.path.basename(self.key) in ENTRY_DOCUMENTS
+
+
+# overwritten are the uploaded keys that replaced an object, the only ones the edge
+# can hold a stale copy of, as new keys were never served and deleted ones are no
+# longer referenced
+class SyncResult:
+    def __init__(self, uploaded, overwritten, deleted, unchanged):
+        self.uploaded = uploaded
+        self.overwritten = overwritten
+        self.deleted = deleted
+        self.unchanged = unchanged
+
+
+def local_assets(local_dir, policy):
+    assets = []
+    for root, _, files in os.walk(local_dir):
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            key = os.path.relpath(path, local_dir).replace(os.sep, "/")
+            extra_args = {"CacheControl": policy.cache_control(key)}
+            content_type = mimetypes.guess_type(path)[0]
+            if content_type is not None:
+                extra_args["ContentType"] = content_type
+            assets.append(
+                Asset(key, path, extra_args, encoding=policy.encoding(content_type))
+            )
+    return assets
+
+
+# get the ETag of every object in the bucket, keyed by object key
+def remote_etags(s3_client, bucket):
+    etags = {}
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket):
+        for item in page.get("Contents", []):
+            etags[item["Key"]] = item["ETag"].strip('"')
+    return etags
+
+
+def manifest_path(bucket):
+    return os.path.join(MANIFEST_DIR, f"{bucket}.json")
+
+
+def load_manifest(bucket):
+    try:
+        with open(manifest_path(bucket)) as fp:
+            return json.load(fp)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+# writes to a temporary file first so an interrupted sync never leaves a partial file
+def save_manifest(bucket, manifest):
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    temporary_path = f"{manifest_path(bucket)}.{os.getpid()}"
+    with open(temporary_path, "w") as fp:
+        json.dump(manifest, fp, indent=2, sort_keys=True)
+    os.replace(temporary_path, manifest_path(bucket))
+
+
+# an object is current when the manifest recorded the same digest for it, or, for
+# objects synced from elsewhere or changed since (so their ETag differs from the one
+# recorded), when its ETag is the content's MD5
+def is_current(asset, etags, manifest):
+    if asset.key not in etags:
+        return False
+    entry = manifest.get(asset.key)
+    if entry is not None and entry["etag"] == etags[asset.key]:
+        return entry["digest"] == asset.digest
+    return etags[asset.key] == asset.md5
+
+
+# syncs a local directory to a bucket, uploading only new and changed files and
+# pruning stale objects once the new files are live
+def sync_directory(s3_client, local_dir, bucket, policy=None, transfer_engine=None):
+    policy = policy or AssetPolicy()
+    transfer_engine = transfer_engine or TransferEngine(s3_client)
+    assets = local_assets(local_dir, policy)
+    # an empty or missing build output would otherwise prune the whole bucket
+    if not assets:
+        raise ValueError(f"No files to sync in {local_dir}")
+    etags = remote_etags(s3_client, bucket)
+    manifest = load_manifest(bucket)
+
+    changed = [asset for asset in assets if not is_current(asset, etags, manifest)]
+    logger.info(
+        f"Syncing {local_dir} to s3://{bucket}: {len(changed)} of {len(assets)} "
+        "files changed"
+    )
+    for entry_documents in [False, True]:
+        transfer_engine.upload(
+            bucket,
+            [
+                (asset.source, asset.key, dict(asset.extra_args))
+                for asset in changed
+                if asset.is_entry_document == entry_documents
+            ],
+        )
+
+    # multipart uploads don't have the content's MD5 as their ETag, so the uploaded
+    # objects are listed again for the ETags they ended up with
+    new_etags = remote_etags(s3_client, bucket) if changed else etags
+    save_manifest(
+        bucket,
+        {
+            asset.key: {"etag": new_etags[asset.key], "digest": asset.digest}
+            for asset in assets
+        },
+    )
+
+    # stale keys include the .sync-manifest.json earlier syncs kept in the bucket
+    keys = {asset.key for asset in assets}
+    stale = sorted(key for key in etags if key not in keys)
+    for start in range(0, len(stale), 1000):
+        logger.info(f"Deleting {len(stale[start : start + 1000])} stale objects")
+        s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={
+                "Objects": [{"Key": key} for key in stale[start : start + 1000]],
+                "Quiet": True,
+            },
+        )
+
+    return SyncResult(
+        uploaded=[asset.key for asset in changed],
+        overwritten=[asset.key for asset in changed if asset.key in etags],
+        deleted=stale,
+        unchanged=len(assets) - len(changed),
+    )
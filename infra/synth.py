@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import shutil
+
+INFRA_DIR = os.path.dirname(os.path.abspath(__file__))
+SYNTH_DIR = os.path.join(INFRA_DIR, ".cache", "synth")
+# the files that define the CDK app, any change to them needs a new synth
+APP_SOURCES = ["app.py", "cdk.json", "stacks"]
+
+
+def sources_hash():
+    digest = hashlib.sha256()
+    for source in APP_SOURCES:
+        path = os.path.join(INFRA_DIR, source)
+        paths = [path]
+        if os.path.isdir(path):
+            paths = sorted(
+                os.path.join(root, file)
+                for root, _, files in os.walk(path)
+                for file in files
+                if file.endswith(".py")
+            )
+        for path in paths:
+            with open(path, "rb") as fp:
+                digest.update(f"{os.path.relpath(path, INFRA_DIR)}:".encode())
+                digest.update(hashlib.sha256(fp.read()).digest())
+    return digest.hexdigest()
+
+
+# the cloud assembly directory for the app synthesized with the given context
+def get_assembly_dir(context, app_sources_hash):
+    digest = hashlib.sha256(f"{context}\n{app_sources_hash}".encode()).hexdigest()
+    return os.path.join(SYNTH_DIR, digest)
+
+
+def is_synthesized(assembly_dir):
+    return os.path.exists(os.path.join(assembly_dir, "manifest.json"))
+
+
+# removes all but the most recently synthesized assemblies
+def prune(keep=10):
+    entries = sorted(
+        (
+            os.path.join(SYNTH_DIR, entry)
+            for entry in os.listdir(SYNTH_DIR)
+            if not entry.endswith(".tmp")
+        ),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    for entry in entries[keep:]:
+        shutil.rmtree(entry, ignore_errors=True)
+
+
+def read_manifest(assembly_dir):
+    with open(os.path.join(assembly_dir, "manifest.json")) as fp:
+        return json.load(fp)
+
+
+# a stack synthesized into a cloud assembly, with its template, region and the other
+# stacks it depends on
+class StackArtifact:
+    def __init__(self, assembly_dir, stack):
+        artifacts = read_manifest(assembly_dir)["artifacts"]
+        artifact = artifacts[stack]
+        with open(
+            os.path.join(assembly_dir, artifact["properties"]["templateFile"])
+        ) as fp:
+            self.template = json.load(fp)
+        self.stack = stack
+        # environments look like aws://<account>/<region>
+        self.region = artifact["environment"].rsplit("/", 1)[-1]
+        self.tags = artifact["properties"].get("tags", {})
+        self.dependencies = [
+            dependency
+            for dependency in artifact.get("dependencies", [])
+            if artifacts[dependency]["type"] == "aws:cloudformation:stack"
+        ]
+        # the stacks that depend on this one
+        self.dependents = [
+            other
+            for other, other_artifact in artifacts.items()
+            if stack in other_artifact.get("dependencies", [])
+            and other_artifact["type"] == "aws:cloudformation:stack"
+        ]
+        # assets (e.g. lambda code) have to be published by the cdk CLI before deploying
+        self.has_assets = any(
+            entry["type"] == "aws:cdk:asset"
+            for entries in artifact.get("metadata", {}).values()
+            for entry in entries
+        ) or any(
+            artifacts[dependency]["type"] == "cdk:asset-manifest"
+            for dependency in artifact.get("dependencies", [])
+        )
+
+    # the parameter values the stack is deployed with, i.e. the template defaults
+    @property
+    def parameters(self):
+        return {
+            key: str(parameter["Default"])
+            for key, parameter in self.template.get("Parameters", {}).items()
+            if "Default" in parameter
+        }
+
+
+# a hash of a template and parameter values that ignores key order and formatting
+def template_hash(template, parameters):
+    return hashlib.sha256(
+        json.dumps([template, parameters], sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()
@@ -0,0 +1,36 @@
+import os
+import sys
+
+import boto3
+import pytest
+from moto import mock_aws
+
+# the infra modules import each other as top-level modules, as when run from infra/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def bucket():
+    return "sano-demo-dev-portal"
+
+
+# an S3 client of a mocked account holding an empty bucket
+@pytest.fixture
+def s3_client(monkeypatch, bucket):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.delenv("AWS_PROFILE", raising=False)
+    with mock_aws():
+        s3_client = boto3.client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket=bucket)
+        yield s3_client
+
+
+# a CloudFormation client of a mocked account without any stacks
+@pytest.fixture
+def cloudformation_client(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.delenv("AWS_PROFILE", raising=False)
+    with mock_aws():
+        yield boto3.client("cloudformation", region_name="us-east-1")
@@ -0,0 +1,51 @@
+import multiprocessing
+
+from cache import DAY, DiscoveryCache
+
+
+def set_entries(path, namespace, count):
+    cache = DiscoveryCache(namespace, path=path)
+    for i in range(count):
+        cache.set(f"entry-{i}", i, DAY)
+
+
+def test_get_set_invalidate(tmp_path):
+    cache = DiscoveryCache("demo/dev", path=str(tmp_path / "discovery.json"))
+    cache.set("subnet_ids", ["subnet-1"], DAY)
+    assert cache.get("subnet_ids") == ["subnet-1"]
+    cache.invalidate("subnet_ids")
+    assert cache.get("subnet_ids") is None
+
+
+def test_expired_entries_are_missing(tmp_path):
+    cache = DiscoveryCache("demo/dev", path=str(tmp_path / "discovery.json"))
+    cache.set("db_host", "db.example.com", -1)
+    assert cache.get("db_host") is None
+
+
+def test_concurrent_processes_keep_every_entry(tmp_path):
+    path = str(tmp_path / "discovery.json")
+    namespaces = ["demo/dev", "demo/staging", "demo/prod"]
+    processes = [
+        multiprocessing.Process(target=set_entries, args=(path, namespace, 100))
+        for namespace in namespaces
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    for namespace in namespaces:
+        cache = DiscoveryCache(namespace, path=path)
+        assert [cache.get(f"entry-{i}") for i in range(100)] == list(range(100))
+
+
+def test_invalidation_survives_other_processes(tmp_path):
+    path = str(tmp_path / "discovery.json")
+    cache = DiscoveryCache("demo/dev", path=path)
+    cache.set("security_group_id", "sg-stale", DAY)
+    process = multiprocessing.Process(target=set_entries, args=(path, "demo/prod", 100))
+    process.start()
+    cache.invalidate("security_group_id")
+    process.join()
+    assert cache.get("security_group_id") is None
@@ -0,0 +1,101 @@
+from moto.cloudformation.models import cloudformation_backends
+from moto.core import DEFAULT_ACCOUNT_ID
+
+import cfn
+
+STACK = "sano-demo-dev-portal"
+TEMPLATE = {
+    "Parameters": {"TopicName": {"Type": "String", "Default": "portal"}},
+    "Resources": {
+        "Topic": {
+            "Type": "AWS::SNS::Topic",
+            "Properties": {"TopicName": {"Ref": "TopicName"}},
+        }
+    },
+}
+
+
+def parameters(stack):
+    return {p["ParameterKey"]: p["ParameterValue"] for p in stack["Parameters"]}
+
+
+def test_deploy_stack_creates_missing_stack(cloudformation_client):
+    assert cfn.get_stack(cloudformation_client, STACK) is None
+
+    assert cfn.deploy_stack(
+        cloudformation_client, STACK, TEMPLATE, {"TopicName": "portal"}, {"org": "demo"}
+    )
+
+    stack = cfn.get_stack(cloudformation_client, STACK)
+    assert stack["StackStatus"] == "CREATE_COMPLETE"
+    assert parameters(stack) == {"TopicName": "portal"}
+    assert stack["Tags"] == [{"Key": "org", "Value": "demo"}]
+
+
+def test_deploy_stack_updates_changed_stack(cloudformation_client):
+    cfn.deploy_stack(cloudformation_client, STACK, TEMPLATE, {"TopicName": "portal"})
+
+    assert cfn.deploy_stack(
+        cloudformation_client, STACK, TEMPLATE, {"TopicName": "admin"}
+    )
+
+    stack = cfn.get_stack(cloudformation_client, STACK)
+    assert stack["StackStatus"] == "UPDATE_COMPLETE"
+    assert parameters(stack) == {"TopicName": "admin"}
+
+
+def test_deploy_stack_without_changes_rejected(cloudformation_client):
+    cfn.deploy_stack(cloudformation_client, STACK, TEMPLATE, {"TopicName": "portal"})
+
+    # moto rejects the change set outright
+    assert not cfn.deploy_stack(
+        cloudformation_client, STACK, TEMPLATE, {"TopicName": "portal"}
+    )
+    assert cfn.get_stack(cloudformation_client, STACK)["StackStatus"] == "CREATE_COMPLETE"
+
+
+def test_deploy_stack_without_changes_failed(cloudformation_client, monkeypatch):
+    cfn.deploy_stack(cloudformation_client, STACK, TEMPLATE, {"TopicName": "portal"})
+    change_sets = cloudformation_client.list_change_sets(StackName=STACK)["Summaries"]
+    # as CloudFormation does, fail the change set rather than rejecting it
+    describe_change_set = cloudformation_client.describe_change_set
+    monkeypatch.setattr(
+        cloudformation_client,
+        "describe_change_set",
+        lambda **kwargs: {
+            **describe_change_set(**kwargs),
+            "Status": "FAILED",
+            "StatusReason": "The submitted information didn't contain changes. "
+            "Submit different information to create a change set.",
+        },
+    )
+
+    assert not cfn.deploy_stack(
+        cloudformation_client, STACK, TEMPLATE, {"TopicName": "admin"}
+    )
+
+    stack = cfn.get_stack(cloudformation_client, STACK)
+    assert stack["StackStatus"] == "CREATE_COMPLETE"
+    assert parameters(stack) == {"TopicName": "portal"}
+    # the failed change set is cleaned up
+    assert (
+        cloudformation_client.list_change_sets(StackName=STACK)["Summaries"]
+        == change_sets
+    )
+
+
+def test_deploy_stack_replaces_stack_that_failed_to_create(cloudformation_client):
+    cfn.deploy_stack(cloudformation_client, STACK, TEMPLATE, {"TopicName": "portal"})
+    failed = cfn.get_stack(cloudformation_client, STACK)
+    # moto creates every stack it can, so fail this one by hand
+    backend = cloudformation_backends[DEFAULT_ACCOUNT_ID]["us-east-1"]
+    backend.stacks[failed["StackId"]].status = "ROLLBACK_COMPLETE"
+
+    assert cfn.deploy_stack(
+        cloudformation_client, STACK, TEMPLATE, {"TopicName": "admin"}
+    )
+
+    stack = cfn.get_stack(cloudformation_client, STACK)
+    assert stack["StackId"] != failed["StackId"]
+    assert stack["StackStatus"] == "CREATE_COMPLETE"
+    assert parameters(stack) == {"TopicName": "admin"}
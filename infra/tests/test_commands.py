@@ -0,0 +1,131 @@
+import asyncio
+import pickle
+import time
+
+import pytest
+
+from commands import Command, CommandFailed, fail_on, run, run_all, run_async
+
+# prints a line, then leaves a child that writes a marker file after a second, to
+# check that stopping a command also stops its children
+COMMAND_WITH_CHILD = "(sleep 1 && touch {marker}) & echo started; sleep 30"
+
+
+def test_returns_the_last_lines_of_output():
+    result = run("for i in 1 2 3 4; do echo line $i; done", tail=2)
+    assert result.ok
+    assert result.tail == ["line 3", "line 4"]
+
+
+def test_check_raises_on_a_failed_command():
+    with pytest.raises(CommandFailed) as excinfo:
+        run("echo broken; exit 3", check=True)
+    assert excinfo.value.result.returncode == 3
+    assert "exit code 3" in str(excinfo.value)
+    assert "broken" in str(excinfo.value)
+
+
+def test_command_failed_survives_pickling():
+    with pytest.raises(CommandFailed) as excinfo:
+        run("echo broken; exit 3", check=True)
+    error = pickle.loads(pickle.dumps(excinfo.value))
+    assert error.result.returncode == 3
+    assert str(error) == str(excinfo.value)
+
+
+def test_matcher_stops_the_command_and_its_children(tmp_path):
+    marker = tmp_path / "marker"
+    start = time.monotonic()
+    result = run(COMMAND_WITH_CHILD.format(marker=marker), matchers=[fail_on("started")])
+    assert time.monotonic() - start < 10
+    assert not result.ok
+    assert "started" in result.aborted
+    time.sleep(1.5)
+    assert not marker.exists()
+
+
+def test_an_interrupted_command_is_stopped_with_its_children(tmp_path):
+    marker = tmp_path / "marker"
+
+    # stands in for a Ctrl-C arriving while the command runs
+    def interrupt(line):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        run(COMMAND_WITH_CHILD.format(marker=marker), matchers=[interrupt])
+    time.sleep(1.5)
+    assert not marker.exists()
+
+
+def test_run_all_returns_results_by_name():
+    results = run_all(
+        [Command("one", "echo one"), Command("two", "echo two; exit 1")], limit=2
+    )
+    assert results["one"].ok
+    assert results["one"].tail == ["one"]
+    assert results["two"].returncode == 1
+
+
+def test_run_all_check_raises_once_all_are_done():
+    with pytest.raises(CommandFailed):
+        run_all([Command("fails", "exit 1"), Command("works", "true")], check=True)
+
+
+def test_run_all_matcher_stops_the_command_and_its_children(tmp_path):
+    marker = tmp_path / "marker"
+    command = Command(
+        "stopped", COMMAND_WITH_CHILD.format(marker=marker), matchers=[fail_on("started")]
+    )
+    result = run_all([command])["stopped"]
+    assert "started" in result.aborted
+    time.sleep(1.5)
+    assert not marker.exists()
+
+
+def test_run_all_timeout_stops_the_command_and_its_children(tmp_path):
+    marker = tmp_path / "marker"
+    command = Command("slow", COMMAND_WITH_CHILD.format(marker=marker), timeout=0.5)
+    start = time.monotonic()
+    result = run_all([command])["slow"]
+    assert time.monotonic() - start < 10
+    assert result.aborted == "timed out after 0.5s"
+    time.sleep(1.5)
+    assert not marker.exists()
+
+
+def test_fail_fast_cancels_the_other_commands(tmp_path):
+    marker = tmp_path / "marker"
+    commands = [
+        Command("fails", "sleep 0.2; exit 1"),
+        Command("running", COMMAND_WITH_CHILD.format(marker=marker)),
+        Command("queued", "echo queued"),
+    ]
+    start = time.monotonic()
+    results = run_all(commands, limit=2, fail_fast=True)
+    assert time.monotonic() - start < 10
+    assert results["fails"].returncode == 1
+    assert results["running"].aborted == "cancelled"
+    assert results["queued"].aborted == "cancelled"
+    time.sleep(1.5)
+    assert not marker.exists()
+
+
+def test_a_command_cancelled_while_starting_is_stopped(tmp_path):
+    markers = [tmp_path / f"marker-{steps}" for steps in range(8)]
+
+    # cancels the command after a number of event loop steps, some of which land
+    # while the process is being spawned
+    async def cancel_after(steps, marker):
+        task = asyncio.ensure_future(
+            run_async(Command("starting", COMMAND_WITH_CHILD.format(marker=marker)))
+        )
+        for _ in range(steps):
+            await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    for steps, marker in enumerate(markers):
+        asyncio.run(cancel_after(steps, marker))
+    time.sleep(1.5)
+    assert not any(marker.exists() for marker in markers)
@@ -0,0 +1,61 @@
+from history import TOTAL, History, StepStats, get_step_durations, percentile
+
+
+def span(name, seconds, category="step"):
+    return {"name": name, "cat": category, "ph": "X", "dur": int(seconds * 1e6)}
+
+
+def test_percentile():
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([1, 2, 3, 4], 95) == 4
+    assert percentile([5], 50) == 5
+
+
+def test_step_durations_add_up_calls_of_a_step():
+    events = [
+        span("deploy backend", 2),
+        span("deploy backend", 3),
+        span("npm run build", 1, "command"),
+        {"name": "thread_name", "ph": "M", "args": {"name": "portal"}},
+    ]
+    assert get_step_durations(events) == {
+        ("step", "deploy backend"): [2, 5.0],
+        ("command", "npm run build"): [1, 1.0],
+    }
+
+
+def test_regressed_against_the_runs_before():
+    assert StepStats("step", "deploy", [10, 10, 12], 20).regressed(1.5, 5)
+    # not slow enough in absolute terms
+    assert not StepStats("step", "deploy", [2, 2, 2], 4).regressed(1.5, 5)
+    # no runs to compare against
+    assert not StepStats("step", "deploy", [], 20).regressed(1.5, 5)
+
+
+def test_step_stats_of_recorded_runs(tmp_path):
+    history = History(str(tmp_path / "history.sqlite3"))
+    for started_at, duration in [(1, 10), (2, 12), (3, 30)]:
+        history.record(
+            "demo",
+            "dev",
+            "all",
+            "deploy",
+            started_at,
+            duration,
+            True,
+            [span("deploy backend", duration - 1)],
+        )
+    # failed runs are left out
+    history.record(
+        "demo", "dev", "all", "deploy", 4, 1, False, [span("deploy backend", 1)]
+    )
+
+    assert history.get_run_keys(0) == [("demo", "dev", "all", "deploy")]
+    stats = {
+        (s.category, s.name): s
+        for s in history.get_step_stats("demo", "dev", "all", "deploy", 0)
+    }
+    assert stats[("run", TOTAL)].latest == 30
+    assert stats[("run", TOTAL)].baseline == 10
+    assert stats[("step", "deploy backend")].runs == 3
+    assert stats[("step", "deploy backend")].regressed(1.5, 5)
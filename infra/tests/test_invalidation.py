@@ -0,0 +1,24 @@
+from invalidation import invalidation_paths
+
+
+def test_paths_of_overwritten_keys():
+    assert invalidation_paths(["favicon.ico", "fonts/Open Sans.woff2"]) == [
+        "/favicon.ico",
+        "/fonts/Open%20Sans.woff2",
+    ]
+
+
+def test_entry_documents_invalidate_everything():
+    # deep links are served the entry document through the cached 404 responses
+    assert invalidation_paths(["favicon.ico", "app.html"]) == ["/*"]
+    assert invalidation_paths(["help/index.html"]) == ["/*"]
+
+
+def test_no_keys_no_paths():
+    assert invalidation_paths([]) == []
+
+
+def test_wildcard_above_the_limit():
+    keys = [f"page-{i}.html" for i in range(5)]
+    assert invalidation_paths(keys, limit=5) == sorted(f"/{key}" for key in keys)
+    assert invalidation_paths(keys, limit=4) == ["/*"]
@@ -0,0 +1,112 @@
+import pytest
+
+import purge
+from purge import empty_bucket, expire_bucket, is_bucket_empty
+
+
+def version_count(s3_client, bucket):
+    response = s3_client.list_object_versions(Bucket=bucket)
+    return len(response.get("Versions", [])) + len(response.get("DeleteMarkers", []))
+
+
+def test_empties_every_version_and_delete_marker(s3_client, bucket):
+    s3_client.put_bucket_versioning(
+        Bucket=bucket, VersioningConfiguration={"Status": "Enabled"}
+    )
+    for i in range(30):
+        s3_client.put_object(Bucket=bucket, Key=f"asset-{i}.js", Body=b"v1")
+        s3_client.put_object(Bucket=bucket, Key=f"asset-{i}.js", Body=b"v2")
+    for i in range(10):
+        s3_client.delete_object(Bucket=bucket, Key=f"asset-{i}.js")
+    assert version_count(s3_client, bucket) == 70
+
+    result = empty_bucket(s3_client, bucket, workers=4)
+
+    assert result.objects == 70
+    assert result.bytes == 60 * 2
+    assert is_bucket_empty(s3_client, bucket)
+
+
+def test_empties_more_than_one_batch(s3_client, bucket, monkeypatch):
+    monkeypatch.setattr("purge.DELETE_BATCH_SIZE", 7)
+    # moto resumes a listing after the exact version it ended on, which S3 doesn't
+    # need, so the pages are all listed before the batches are deleted
+    list_version_batches = purge.list_version_batches
+    monkeypatch.setattr(
+        "purge.list_version_batches",
+        lambda s3_client, bucket: iter(list(list_version_batches(s3_client, bucket))),
+    )
+    for i in range(50):
+        s3_client.put_object(Bucket=bucket, Key=f"asset-{i}.js", Body=b"x")
+
+    result = empty_bucket(s3_client, bucket, workers=2)
+
+    assert result.objects == 50
+    assert is_bucket_empty(s3_client, bucket)
+
+
+def test_missing_bucket_is_already_empty(s3_client):
+    assert empty_bucket(s3_client, "sano-demo-dev-missing").objects == 0
+    assert is_bucket_empty(s3_client, "sano-demo-dev-missing")
+
+
+def test_leaves_nothing_behind_in_other_buckets(s3_client, bucket):
+    s3_client.create_bucket(Bucket="sano-demo-dev-admin")
+    s3_client.put_object(Bucket="sano-demo-dev-admin", Key="index.html", Body=b"x")
+    s3_client.put_object(Bucket=bucket, Key="index.html", Body=b"x")
+
+    empty_bucket(s3_client, bucket)
+
+    assert is_bucket_empty(s3_client, bucket)
+    assert not is_bucket_empty(s3_client, "sano-demo-dev-admin")
+
+
+def test_expire_bucket_sets_rules_expiring_everything(s3_client, bucket):
+    expire_bucket(s3_client, bucket)
+
+    rules = s3_client.get_bucket_lifecycle_configuration(Bucket=bucket)["Rules"]
+    assert {rule["ID"] for rule in rules} == {
+        "expire-everything",
+        "remove-expired-delete-markers",
+    }
+
+
+# fails to delete the given keys on the first failures calls of delete_objects
+class FlakyS3Client:
+    def __init__(self, failing_keys, failures):
+        self.failing_keys = failing_keys
+        self.failures = failures
+        self.calls = []
+
+    def delete_objects(self, Bucket, Delete):
+        self.calls.append([entry["Key"] for entry in Delete["Objects"]])
+        if len(self.calls) > self.failures:
+            return {}
+        return {
+            "Errors": [
+                {
+                    "Key": entry["Key"],
+                    "VersionId": entry["VersionId"],
+                    "Code": "SlowDown",
+                    "Message": "Please reduce your request rate.",
+                }
+                for entry in Delete["Objects"]
+                if entry["Key"] in self.failing_keys
+            ]
+        }
+
+
+OBJECTS = [{"Key": key, "VersionId": "1"} for key in ["a.js", "b.js", "c.js"]]
+
+
+def test_delete_batch_retries_only_the_failed_keys():
+    s3_client = FlakyS3Client({"b.js"}, failures=2)
+    purge.delete_batch(s3_client, "bucket", OBJECTS, delay=0)
+    assert s3_client.calls == [["a.js", "b.js", "c.js"], ["b.js"], ["b.js"]]
+
+
+def test_delete_batch_gives_up_after_its_attempts():
+    s3_client = FlakyS3Client({"c.js"}, failures=10)
+    with pytest.raises(RuntimeError):
+        purge.delete_batch(s3_client, "bucket", OBJECTS, attempts=3, delay=0)
+    assert len(s3_client.calls) == 3
@@ -0,0 +1,45 @@
+import pytest
+
+from ratelimit import RateLimiter, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("ratelimit.time.monotonic", lambda: now[0])
+    return now
+
+
+def test_bursts_up_to_the_capacity_then_spaces_out_calls(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    # callers queue up behind each other at the rate
+    assert [bucket.reserve() for _ in range(3)] == [0.5, 1.0, 1.5]
+    assert bucket.delayed_calls == 3
+    assert bucket.max_delay == 1.5
+
+
+def test_refills_over_time(clock):
+    bucket = TokenBucket(rate=2, burst=2)
+    bucket.reserve()
+    bucket.reserve()
+    clock[0] += 1
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0.5
+
+
+def test_throttling_empties_the_bucket(clock):
+    bucket = TokenBucket(rate=4, burst=4)
+    bucket.throttled()
+    assert bucket.reserve() == 0.25
+    assert bucket.throttles == 1
+
+
+def test_buckets_are_shared_by_account_service_and_region():
+    limiter = RateLimiter()
+    bucket = limiter.get_bucket(("demo", "cloudformation", "eu-west-2"), 5)
+    assert limiter.get_bucket(("demo", "cloudformation", "eu-west-2"), 5) is bucket
+    assert limiter.get_bucket(("demo", "cloudformation", "us-east-1"), 5) is not bucket
+    limiter.clear()
+    assert limiter.get_bucket(("demo", "cloudformation", "eu-west-2"), 5) is not bucket
@@ -0,0 +1,104 @@
+import pickle
+import threading
+
+import pytest
+
+from scheduler import GraphFailed, Node, get_dependencies, run_graph
+
+
+# a graph of vpc <- backend <- zappa and an independent certificate, whose steps
+# record the order they ran in
+class Recorder:
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def step(self, name):
+        def step():
+            with self.lock:
+                self.calls.append(name)
+            if name in self.failing:
+                raise RuntimeError(f"{name} failed")
+
+        return step
+
+    def graph(self):
+        return [
+            Node(name, setup=self.step(name), teardown=self.step(name), deps=deps)
+            for name, deps in [
+                ("vpc", []),
+                ("backend", ["vpc"]),
+                ("zappa", ["backend"]),
+                ("certificate", []),
+            ]
+        ]
+
+
+def test_setup_follows_the_dependencies():
+    recorder = Recorder()
+    run_graph(recorder.graph(), ["zappa", "backend", "vpc"], width=4)
+    assert recorder.calls == ["vpc", "backend", "zappa"]
+
+
+def test_teardown_follows_the_dependencies_in_reverse():
+    recorder = Recorder()
+    run_graph(recorder.graph(), ["vpc", "backend", "zappa"], action="teardown", width=4)
+    assert recorder.calls == ["zappa", "backend", "vpc"]
+
+
+def test_setup_only_dependencies_do_not_hold_up_teardown():
+    nodes = {
+        "zappa": Node("zappa"),
+        "portal-stack": Node("portal-stack", setup_only_deps=["zappa"]),
+    }
+    selected = list(nodes)
+    assert get_dependencies(nodes, selected, "setup") == {
+        "zappa": set(),
+        "portal-stack": {"zappa"},
+    }
+    assert get_dependencies(nodes, selected, "teardown") == {
+        "zappa": set(),
+        "portal-stack": set(),
+    }
+
+
+def test_fail_fast_starts_nothing_after_a_failure():
+    recorder = Recorder(failing={"vpc"})
+    with pytest.raises(GraphFailed) as excinfo:
+        run_graph(recorder.graph(), ["vpc", "certificate", "backend"], width=1)
+    assert recorder.calls == ["vpc"]
+    assert list(excinfo.value.failed) == ["vpc"]
+    assert excinfo.value.skipped == ["certificate", "backend"]
+
+
+def test_keep_going_only_skips_the_dependents_of_a_failure():
+    recorder = Recorder(failing={"vpc"})
+    with pytest.raises(GraphFailed) as excinfo:
+        run_graph(
+            recorder.graph(),
+            ["vpc", "certificate", "backend", "zappa"],
+            width=1,
+            fail_fast=False,
+        )
+    assert recorder.calls == ["vpc", "certificate"]
+    assert list(excinfo.value.failed) == ["vpc"]
+    assert excinfo.value.skipped == ["backend", "zappa"]
+
+
+def test_cycles_are_rejected_before_anything_runs():
+    recorder = Recorder()
+    graph = [
+        Node("a", setup=recorder.step("a"), deps=["b"]),
+        Node("b", setup=recorder.step("b"), deps=["a"]),
+    ]
+    with pytest.raises(ValueError):
+        run_graph(graph, ["a", "b"])
+    assert recorder.calls == []
+
+
+def test_graph_failed_survives_pickling():
+    error = pickle.loads(pickle.dumps(GraphFailed({"vpc": RuntimeError("x")}, ["zappa"])))
+    assert list(error.failed) == ["vpc"]
+    assert error.skipped == ["zappa"]
+    assert str(error) == "Steps failed: ['vpc'], not run: ['zappa']"
@@ -0,0 +1,141 @@
+import gzip
+import os
+
+import pytest
+
+from asset_policy import IMMUTABLE, AssetPolicy
+import sync
+from sync import sync_directory
+
+
+# keeps the manifests of the mocked buckets out of the checkout's cache
+@pytest.fixture(autouse=True)
+def manifest_dir(tmp_path_factory, monkeypatch):
+    manifest_dir = tmp_path_factory.mktemp("sync")
+    monkeypatch.setattr(sync, "MANIFEST_DIR", str(manifest_dir))
+    return manifest_dir
+
+
+def write_build(directory, files):
+    for key, content in files.items():
+        path = directory / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+
+def bucket_keys(s3_client, bucket):
+    response = s3_client.list_objects_v2(Bucket=bucket)
+    return sorted(item["Key"] for item in response.get("Contents", []))
+
+
+BUILD = {
+    "index.html": "<script src='main.3f2a1b9c.js'></script>",
+    "main.3f2a1b9c.js": "console.log('portal')",
+    "static/logo.svg": "<svg></svg>",
+}
+
+
+def test_uploads_a_new_build(tmp_path, s3_client, bucket):
+    write_build(tmp_path, BUILD)
+    result = sync_directory(s3_client, str(tmp_path), bucket)
+
+    assert sorted(result.uploaded) == sorted(BUILD)
+    assert result.overwritten == []
+    assert result.deleted == []
+    assert bucket_keys(s3_client, bucket) == sorted(BUILD)
+    index = s3_client.get_object(Bucket=bucket, Key="index.html")
+    assert index["CacheControl"] == "no-cache"
+    assert index["ContentType"] == "text/html"
+    bundle = s3_client.get_object(Bucket=bucket, Key="main.3f2a1b9c.js")
+    assert bundle["CacheControl"] == IMMUTABLE
+
+
+def test_precompresses_text_assets(tmp_path, s3_client, bucket):
+    write_build(tmp_path, {"app.js": "console.log('portal');" * 100})
+    sync_directory(s3_client, str(tmp_path), bucket)
+
+    response = s3_client.get_object(Bucket=bucket, Key="app.js")
+    assert response["ContentEncoding"] == "gzip"
+    assert gzip.decompress(response["Body"].read()) == b"console.log('portal');" * 100
+
+
+def test_skips_unchanged_files(tmp_path, s3_client, bucket):
+    write_build(tmp_path, BUILD)
+    sync_directory(s3_client, str(tmp_path), bucket)
+    result = sync_directory(s3_client, str(tmp_path), bucket)
+
+    assert result.uploaded == []
+    assert result.unchanged == len(BUILD)
+
+
+def test_overwritten_are_only_the_replaced_keys(tmp_path, s3_client, bucket):
+    write_build(tmp_path, BUILD)
+    sync_directory(s3_client, str(tmp_path), bucket)
+    (tmp_path / "main.3f2a1b9c.js").unlink()
+    write_build(
+        tmp_path,
+        {
+            "index.html": "<script src='main.77aa00bb.js'></script>",
+            "main.77aa00bb.js": "console.log('portal v2')",
+        },
+    )
+    result = sync_directory(s3_client, str(tmp_path), bucket)
+
+    assert sorted(result.uploaded) == ["index.html", "main.77aa00bb.js"]
+    assert result.overwritten == ["index.html"]
+    assert result.deleted == ["main.3f2a1b9c.js"]
+
+
+def test_prunes_stale_keys(tmp_path, s3_client, bucket):
+    write_build(tmp_path, BUILD)
+    sync_directory(s3_client, str(tmp_path), bucket)
+    s3_client.put_object(Bucket=bucket, Key="old/leftover.js", Body=b"stale")
+    (tmp_path / "static" / "logo.svg").unlink()
+    result = sync_directory(s3_client, str(tmp_path), bucket)
+
+    assert result.deleted == ["old/leftover.js", "static/logo.svg"]
+    assert bucket_keys(s3_client, bucket) == ["index.html", "main.3f2a1b9c.js"]
+
+
+def test_reuploads_on_a_policy_change(tmp_path, s3_client, bucket):
+    write_build(tmp_path, BUILD)
+    sync_directory(s3_client, str(tmp_path), bucket)
+    policy = AssetPolicy(cache_control_rules=[(r"\.svg$", "max-age=60")])
+    result = sync_directory(s3_client, str(tmp_path), bucket, policy=policy)
+
+    assert result.uploaded == ["static/logo.svg"]
+    assert result.overwritten == ["static/logo.svg"]
+    logo = s3_client.get_object(Bucket=bucket, Key="static/logo.svg")
+    assert logo["CacheControl"] == "max-age=60"
+
+
+def test_reuploads_objects_changed_since_the_last_sync(tmp_path, s3_client, bucket):
+    write_build(tmp_path, BUILD)
+    sync_directory(s3_client, str(tmp_path), bucket)
+    s3_client.put_object(Bucket=bucket, Key="index.html", Body=b"<p>hotfix</p>")
+    result = sync_directory(s3_client, str(tmp_path), bucket)
+
+    assert result.uploaded == ["index.html"]
+    index = s3_client.get_object(Bucket=bucket, Key="index.html")
+    assert index["Body"].read().decode() == BUILD["index.html"]
+
+
+def test_keeps_the_manifest_out_of_the_bucket(tmp_path, s3_client, bucket, manifest_dir):
+    # earlier syncs kept the manifest in the publicly readable bucket
+    s3_client.put_object(Bucket=bucket, Key=".sync-manifest.json", Body=b"{}")
+    write_build(tmp_path, BUILD)
+    result = sync_directory(s3_client, str(tmp_path), bucket)
+
+    assert result.deleted == [".sync-manifest.json"]
+    assert bucket_keys(s3_client, bucket) == sorted(BUILD)
+    assert os.listdir(manifest_dir) == [f"{bucket}.json"]
+
+
+def test_refuses_to_sync_an_empty_build(tmp_path, s3_client, bucket):
+    write_build(tmp_path, BUILD)
+    sync_directory(s3_client, str(tmp_path), bucket)
+    empty_dir = tmp_path / "empty"
+    empty_dir.mkdir()
+    with pytest.raises(ValueError):
+        sync_directory(s3_client, str(empty_dir), bucket)
+    assert "index.html" in bucket_keys(s3_client, bucket)
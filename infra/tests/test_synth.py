@@ -0,0 +1,190 @@
+import json
+
+import pytest
+from moto.cloudformation.models import cloudformation_backends
+from moto.core import DEFAULT_ACCOUNT_ID
+
+import cfn
+import utils
+from synth import StackArtifact, template_hash
+
+
+def template(topic_name):
+    return {
+        "Parameters": {"TopicName": {"Type": "String", "Default": topic_name}},
+        "Resources": {
+            "Topic": {
+                "Type": "AWS::SNS::Topic",
+                "Properties": {"TopicName": {"Ref": "TopicName"}},
+            }
+        },
+    }
+
+
+# writes a cloud assembly of the given stack templates, and the stacks each depends on
+def write_assembly(assembly_dir, templates, dependencies=None):
+    artifacts = {}
+    for stack, stack_template in templates.items():
+        template_file = f"{stack}.template.json"
+        with open(assembly_dir / template_file, "w") as fp:
+            json.dump(stack_template, fp)
+        artifacts[stack] = {
+            "type": "aws:cloudformation:stack",
+            "environment": "aws://123456789012/us-east-1",
+            "properties": {"templateFile": template_file, "tags": {"org": "demo"}},
+            "dependencies": (dependencies or {}).get(stack, []),
+        }
+    artifacts["Tree"] = {"type": "cdk:tree", "properties": {"file": "tree.json"}}
+    with open(assembly_dir / "manifest.json", "w") as fp:
+        json.dump({"version": "12.0.0", "artifacts": artifacts}, fp)
+    return str(assembly_dir)
+
+
+def test_stack_artifact(tmp_path):
+    assembly_dir = write_assembly(
+        tmp_path,
+        {"sano-demo-dev-network": template("network"), "sano-demo-dev-portal": {}},
+        {"sano-demo-dev-portal": ["sano-demo-dev-network", "Tree"]},
+    )
+
+    network = StackArtifact(assembly_dir, "sano-demo-dev-network")
+    portal = StackArtifact(assembly_dir, "sano-demo-dev-portal")
+
+    assert network.template == template("network")
+    assert network.region == "us-east-1"
+    assert network.tags == {"org": "demo"}
+    assert network.parameters == {"TopicName": "network"}
+    assert network.dependencies == []
+    assert network.dependents == ["sano-demo-dev-portal"]
+    assert not network.has_assets
+    # only stacks count as dependencies
+    assert portal.dependencies == ["sano-demo-dev-network"]
+    assert portal.dependents == []
+    assert portal.parameters == {}
+
+
+def test_template_hash_ignores_key_order():
+    reordered = {
+        "Resources": template("portal")["Resources"],
+        "Parameters": {"TopicName": {"Default": "portal", "Type": "String"}},
+    }
+
+    assert template_hash(reordered, {"TopicName": "portal"}) == template_hash(
+        template("portal"), {"TopicName": "portal"}
+    )
+    assert template_hash(template("portal"), {"TopicName": "admin"}) != template_hash(
+        template("portal"), {"TopicName": "portal"}
+    )
+    assert template_hash(template("admin"), {"TopicName": "portal"}) != template_hash(
+        template("portal"), {"TopicName": "portal"}
+    )
+
+
+# a stack manager deploying to the mocked account, without any of its config
+class StackManager:
+    get_deploy_reason = utils.StackManager.get_deploy_reason
+
+    def __init__(self, cloudformation_client):
+        self.cloudformation_client = cloudformation_client
+
+    def get_cloudformation_client(self, region):
+        return self.cloudformation_client
+
+
+@pytest.fixture
+def assembly_dir(tmp_path):
+    return write_assembly(
+        tmp_path,
+        {
+            "sano-demo-dev-network": template("network"),
+            "sano-demo-dev-portal": template("portal"),
+        },
+        {"sano-demo-dev-portal": ["sano-demo-dev-network"]},
+    )
+
+
+# deploys the stacks of the assembly as synthesized
+def deploy(cloudformation_client, assembly_dir, *stacks):
+    for stack in stacks:
+        artifact = StackArtifact(assembly_dir, stack)
+        cfn.deploy_stack(
+            cloudformation_client, stack, artifact.template, artifact.parameters
+        )
+
+
+def test_deploy_reason_not_deployed(cloudformation_client, assembly_dir):
+    manager = StackManager(cloudformation_client)
+
+    assert manager.get_deploy_reason(assembly_dir, "sano-demo-dev-portal") == (
+        "not deployed yet"
+    )
+
+
+def test_deploy_reason_unchanged(cloudformation_client, assembly_dir):
+    deploy(
+        cloudformation_client,
+        assembly_dir,
+        "sano-demo-dev-network",
+        "sano-demo-dev-portal",
+    )
+    manager = StackManager(cloudformation_client)
+
+    assert manager.get_deploy_reason(assembly_dir, "sano-demo-dev-portal") is None
+
+
+def test_deploy_reason_changed_parameter(cloudformation_client, assembly_dir):
+    deploy(cloudformation_client, assembly_dir, "sano-demo-dev-network")
+    artifact = StackArtifact(assembly_dir, "sano-demo-dev-portal")
+    cfn.deploy_stack(
+        cloudformation_client,
+        "sano-demo-dev-portal",
+        artifact.template,
+        {"TopicName": "admin"},
+    )
+    manager = StackManager(cloudformation_client)
+
+    assert manager.get_deploy_reason(assembly_dir, "sano-demo-dev-portal") == (
+        "template changed"
+    )
+
+
+def test_deploy_reason_changed_dependency(cloudformation_client, assembly_dir, tmp_path):
+    deploy(
+        cloudformation_client,
+        assembly_dir,
+        "sano-demo-dev-network",
+        "sano-demo-dev-portal",
+    )
+    changed = template("network")
+    changed["Resources"]["Queue"] = {"Type": "AWS::SQS::Queue"}
+    write_assembly(
+        tmp_path,
+        {"sano-demo-dev-network": changed, "sano-demo-dev-portal": template("portal")},
+        {"sano-demo-dev-portal": ["sano-demo-dev-network"]},
+    )
+    manager = StackManager(cloudformation_client)
+
+    assert manager.get_deploy_reason(assembly_dir, "sano-demo-dev-network") == (
+        "template changed"
+    )
+    assert manager.get_deploy_reason(assembly_dir, "sano-demo-dev-portal") == (
+        "sano-demo-dev-network needs deploying, template changed"
+    )
+
+
+def test_deploy_reason_stack_in_progress(cloudformation_client, assembly_dir):
+    deploy(
+        cloudformation_client,
+        assembly_dir,
+        "sano-demo-dev-network",
+        "sano-demo-dev-portal",
+    )
+    stack_id = cfn.get_stack(cloudformation_client, "sano-demo-dev-portal")["StackId"]
+    # moto settles every stack at once, so leave this one updating by hand
+    backend = cloudformation_backends[DEFAULT_ACCOUNT_ID]["us-east-1"]
+    backend.stacks[stack_id].status = "UPDATE_IN_PROGRESS"
+    manager = StackManager(cloudformation_client)
+
+    assert manager.get_deploy_reason(assembly_dir, "sano-demo-dev-portal") == (
+        "stack is UPDATE_IN_PROGRESS"
+    )
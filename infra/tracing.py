@@ -0,0 +1,138 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+TRACE_DIR = "logs"
+
+
+# collects timed spans of a run as Chrome trace events, viewable in chrome://tracing
+# or https://ui.perfetto.dev, where nesting shows as stacked bars per thread
+class Tracer:
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+        # timestamps are microseconds since the epoch, so traces of the worker
+        # processes of a run line up when loaded together
+        self.epoch = time.time() - time.perf_counter()
+
+    def add(self, name, category, start, end, tid=None, args=None):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": int((self.epoch + start) * 1e6),
+            "dur": int((end - start) * 1e6),
+            "pid": os.getpid(),
+            "tid": threading.get_ident() if tid is None else tid,
+            "args": args or {},
+        }
+        with self.lock:
+            self.events.append(event)
+
+    # names the row of a tid, e.g. a command run alongside others in one thread
+    def name_thread(self, tid, name):
+        with self.lock:
+            self.events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+            )
+
+    @contextmanager
+    def span(self, name, category="step", tid=None, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            args["error"] = repr(e)
+            raise
+        finally:
+            self.add(name, category, start, time.perf_counter(), tid, args)
+
+    # the spans added since a mark(), e.g. those of one env of a run
+    def mark(self):
+        with self.lock:
+            return len(self.events)
+
+    def events_since(self, mark):
+        with self.lock:
+            return self.events[mark:]
+
+    # drops the spans so far, e.g. those a forked worker process inherited
+    def clear(self):
+        with self.lock:
+            self.events = []
+
+    def export(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.lock:
+            events = list(self.events)
+        with open(path, "w") as fp:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp)
+        logger.info(f"Wrote trace of {len(events)} spans to {path}")
+        return path
+
+
+# the tracer of this process
+tracer = Tracer()
+span = tracer.span
+
+
+# traces every call of the public methods of a class
+def trace_methods(cls):
+    for name, method in list(vars(cls).items()):
+        if callable(method) and not name.startswith("_"):
+            setattr(cls, name, traced(method, f"{cls.__name__}.{name}"))
+    return cls
+
+
+def traced(function, name=None, category="step"):
+    name = name or function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with span(name, category):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+# traces every AWS API call of the clients a boto3 session creates from now on
+def trace_session(session):
+    def before_call(context, **kwargs):
+        context["trace_start"] = time.perf_counter()
+
+    def after_call(event_name, context, **kwargs):
+        if "trace_start" not in context:
+            return
+        # e.g. after-call.cloudformation.DescribeStacks
+        _, service, operation = event_name.split(".", 2)
+        tracer.add(
+            f"{service}.{operation}",
+            "aws",
+            context.pop("trace_start"),
+            time.perf_counter(),
+            # after-call-error passes the exception, after-call any error response
+            args={"error": "exception" in kwargs or "Error" in kwargs.get("parsed", {})},
+        )
+
+    session.events.register("before-call", before_call)
+    session.events.register("after-call", after_call)
+    session.events.register("after-call-error", after_call)
+
+
+# the path a run's trace is exported to, e.g. logs/trace-20211014-093000-demo-setup.json
+def get_trace_path(*names):
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return os.path.join(TRACE_DIR, "-".join(["trace", timestamp, *names]) + ".json")
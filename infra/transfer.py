@@ -0,0 +1,94 @@
+import io
+import logging
+import os
+import threading
+import time
+
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from s3transfer.subscribers import BaseSubscriber
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+# logs the progress of one upload, in quarters for multipart uploads, and its duration
+class ProgressLogger(BaseSubscriber):
+    def __init__(self, key, size, multipart_threshold):
+        self.key = key
+        self.size = size
+        self.log_progress = size >= multipart_threshold
+        self.transferred = 0
+        self.logged_quarters = 0
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def on_progress(self, future, bytes_transferred, **kwargs):
+        with self.lock:
+            self.transferred += bytes_transferred
+            quarters = 4 * self.transferred // self.size if self.size else 4
+            if self.log_progress and 0 < quarters < 4 and quarters > self.logged_quarters:
+                self.logged_quarters = quarters
+                logger.info(f"Uploading {self.key}: {25 * quarters}%")
+
+    def on_done(self, future, **kwargs):
+        try:
+            future.result()
+        except Exception:
+            # failures are raised by TransferEngine.upload
+            return
+        elapsed = time.monotonic() - self.start
+        logger.info(f"Uploaded {self.key} ({self.size / MB:.2f} MB in {elapsed:.2f}s)")
+
+
+# uploads files to S3 in-process, over one pool of threads shared by all files, using
+# multipart uploads for files above the threshold
+class TransferEngine:
+    def __init__(
+        self,
+        s3_client,
+        max_concurrency=16,
+        multipart_threshold=8 * MB,
+        multipart_chunksize=8 * MB,
+    ):
+        self.s3_client = s3_client
+        self.config = TransferConfig(
+            max_concurrency=max_concurrency,
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+        )
+
+    # uploads (source, key, extra_args) tuples to the bucket, where the source is a
+    # path or the bytes to upload, raising the first failure
+    def upload(self, bucket, uploads):
+        if not uploads:
+            return
+        start = time.monotonic()
+        total_size = 0
+        with create_transfer_manager(self.s3_client, self.config) as manager:
+            futures = []
+            for source, key, extra_args in uploads:
+                if isinstance(source, bytes):
+                    size = len(source)
+                    source = io.BytesIO(source)
+                else:
+                    size = os.path.getsize(source)
+                total_size += size
+                futures.append(
+                    manager.upload(
+                        source,
+                        bucket,
+                        key,
+                        extra_args=extra_args,
+                        subscribers=[
+                            ProgressLogger(key, size, self.config.multipart_threshold)
+                        ],
+                    )
+                )
+            for future in futures:
+                future.result()
+        elapsed = time.monotonic() - start
+        logger.info(
+            f"Uploaded {len(uploads)} files ({total_size / MB:.2f} MB) to s3://{bucket} "
+            f"in {elapsed:.2f}s ({total_size / MB / max(elapsed, 0.001):.2f} MB/s)"
+        )
@@ -1,35 +1,121 @@
+import json
 import logging
-import subprocess
-from time import sleep
-
-import boto3
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+import cfn
+from asset_policy import AssetPolicy
+from build_cache import (
+    ARTIFACT_DIR,
+    CACHE_DIR,
+    BuildCache,
+    needs_install,
+    record_install,
+)
+from cache import DAY, DiscoveryCache, cached
+from clients import DEFAULT_MAX_POOL_CONNECTIONS, ClientRegistry
+from commands import Command, fail_on, run, run_all
+from discovery import (
+    DistributionIndex,
+    find_certificate_arn,
+    find_latest_function_version_arn,
+    find_rest_api_id,
+    find_stack_distribution_id,
+    find_subnet_ids,
+)
+from invalidation import (
+    DEFAULT_PATH_LIMIT,
+    create_invalidations,
+    invalidation_paths,
+    wait_for_invalidations,
+)
+from polling import wait_until
+from purge import empty_bucket, expire_bucket, is_bucket_empty
+from ratelimit import rate_limiter
+from scheduler import Node, run_graph
+from stacks import STACK_DEPENDENCIES, with_dependencies, with_dependents
+from synth import (
+    StackArtifact,
+    get_assembly_dir,
+    is_synthesized,
+    prune,
+    sources_hash,
+    template_hash,
+)
+from sync import sync_directory
+from tracing import trace_methods, trace_session
+from transfer import TransferEngine
 
 logger = logging.getLogger(__name__)
 
 
-# runs a command in the shell while retaining logs
-def run(command, **kwargs):
-    output = ""
-    process = subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        shell=True,
-        **kwargs,
-    )
-    while process.poll() is None:
-        line = process.stdout.readline().decode()
-        output += line
-        while line:
-            logger.log(logging.INFO, line.strip())
-            line = process.stdout.readline().decode()
-            output += line
-
-    return output
-
-
+@trace_methods
 class StackManager:
-    def __init__(self, infra_config, server_private_config):
+    # resources discovered from AWS on first use, and the methods that discover them
+    DISCOVERED_RESOURCES = {
+        "api_gateway_url": "get_api_gateway_url",
+        "certificate_arn": "get_certificate_arn",
+        "redirect_lambda_arn": "get_redirect_lambda_arn",
+        "distribution_index": "get_distribution_index",
+    }
+
+    # cached values that deploying or destroying each kind of stack can change
+    STACK_CACHE_ENTRIES = {
+        "certificate": ["certificate_arn"],
+        "vpc": ["subnet_ids", "security_group_id", "db_host"],
+        "backend": ["subnet_ids", "security_group_id", "db_host"],
+        "portal": ["portal_distribution_id", "distribution_index"],
+        "admin": ["admin_distribution_id", "distribution_index"],
+    }
+
+    # the nodes of get_graph() that deploy a stack, and the kind of stack they deploy
+    GRAPH_STACKS = {
+        "certificate": "certificate",
+        "vpc": "vpc",
+        "backend": "backend",
+        "portal-stack": "portal",
+        "admin-stack": "admin",
+    }
+
+    # infra config settings for the lifecycle rules of the portal and admin buckets
+    FRONTEND_BUCKET_LIFECYCLE_SETTINGS = [
+        "noncurrent_version_expiration_days",
+        "noncurrent_versions_to_retain",
+        "abort_incomplete_multipart_upload_days",
+    ]
+
+    # the nodes of get_graph() that every env of an org shares
+    SHARED_NODES = ["certificate", "vpc"]
+
+    # the nodes of get_graph() that make up an env
+    ENVIRONMENT_NODES = [
+        "backend",
+        "zappa",
+        "portal-stack",
+        "portal",
+        "admin-stack",
+        "admin",
+    ]
+
+    def __init__(
+        self,
+        infra_config,
+        server_private_config,
+        refresh=False,
+        wait_for_invalidations=False,
+        jobs=4,
+        keep_going=False,
+        force_deploy=False,
+        engine="cdk",
+        rate_limit_shares=1,
+        expire_buckets=False,
+        release_artifacts=None,
+    ):
         self.infra_config = infra_config
         self.server_private_config = server_private_config
         self.org = infra_config["org"]
@@ -41,92 +127,232 @@ class StackManager:
         self.SOE = f"sano-{self.org}-{self.env}"
         self.lambda_function_name = f"sano-server-{self.env}-{self.org}"
 
-        # set boto3 clients
-        boto3.setup_default_session(profile_name=self.aws_profile)
-        self.lambda_client = boto3.client("lambda")
-        self.ec2_client = boto3.client("ec2")
-        self.rds_client = boto3.client("rds")
-        self.cloudfront_client = boto3.client("cloudfront")
-        self.virginia_lambda_client = boto3.client("lambda", region_name="us-east-1")
+        # boto3 clients, created when first used
+        self.transfer_concurrency = infra_config.get("transfer_concurrency", 16)
+        self.clients = ClientRegistry(
+            profile_name=self.aws_profile,
+            # uploads run in many threads, which each need their own connection
+            max_pool_connections=max(
+                infra_config.get("max_pool_connections", DEFAULT_MAX_POOL_CONNECTIONS),
+                self.transfer_concurrency,
+            ),
+        )
+        trace_session(self.clients.session)
+        # AWS throttles per account, so env workers running at once share its limits
+        rate_limiter.attach(
+            self.clients.session,
+            self.aws_profile,
+            infra_config.get("api_rate_limits"),
+            rate_limit_shares,
+        )
 
-        # get AWS resources
-        self.api_gateway_url = self.get_api_gateway_url()
-        self.certificate_arn = self.get_certificate_arn()
-        self.redirect_lambda_arn = self.get_redirect_lambda_arn()
-        self.cdk_context = self.get_cdk_context_string()
+        # AWS resources are only discovered when first needed, see resolve()
+        self.resources = {}
+        self.resources_lock = threading.Lock()
+
+        # identifiers discovered by previous runs, see cache.py
+        self.cache = DiscoveryCache(
+            f"{self.aws_profile}/{infra_config['region']}/{self.org}/{self.env}"
+        )
+        if refresh:
+            self.cache.clear()
+
+        # cloudfront invalidations, issued together when batched, see flush_invalidations()
+        self.wait_for_invalidations = wait_for_invalidations
+        self.pending_invalidations = {}
+        self.batching_invalidations = False
+        self.invalidations_lock = threading.Lock()
+
+        # how many independent steps run at once, and whether to carry on after a failure
+        self.jobs = jobs
+        self.keep_going = keep_going
+
+        # CDK apps synthesized by this or previous runs, see synthesize()
+        self.synth_lock = threading.Lock()
+        self.app_sources_hash = None
+        # the kinds of stacks the current graph run will touch, synthesized together
+        self.planned_stacks = set()
+        # deploy stacks even when their deployed template is unchanged
+        self.force_deploy = force_deploy
+        # whether stacks are deployed by the cdk CLI or through change sets, see cfn.py
+        self.engine = engine
+        # leave emptying buckets to S3 lifecycle rules, see destroy_stack_with_bucket()
+        self.expire_buckets = expire_buckets
+        # the release artifacts built once for every env promoted, by frontend
+        self.release_artifacts = release_artifacts or {}
+
+    @property
+    def api_gateway_url(self):
+        return self.resolve("api_gateway_url")[0]
+
+    @property
+    def certificate_arn(self):
+        return self.resolve("certificate_arn")[0]
+
+    @property
+    def redirect_lambda_arn(self):
+        return self.resolve("redirect_lambda_arn")[0]
+
+    @property
+    def distribution_index(self):
+        return self.resolve("distribution_index")[0]
+
+    # returns the named resources, discovering any not yet known concurrently
+    def resolve(self, *names):
+        with self.resources_lock:
+            missing = [name for name in names if name not in self.resources]
+            if missing:
+                with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+                    futures = {
+                        name: executor.submit(
+                            getattr(self, self.DISCOVERED_RESOURCES[name])
+                        )
+                        for name in missing
+                    }
+                for name, future in futures.items():
+                    self.resources[name] = future.result()
+            return [self.resources[name] for name in names]
+
+    # forgets the named resources so they are discovered again on next use
+    def forget(self, *names):
+        with self.resources_lock:
+            for name in names:
+                self.resources.pop(name, None)
+
+    # get the kind of a stack from its name, e.g. portal for sano-demo-dev-portal-stack
+    def get_stack_kind(self, stack):
+        for kind in STACK_DEPENDENCIES:
+            if f"-{kind}-stack" in stack:
+                return kind
+        raise ValueError(f"Unknown stack {stack}")
+
+    # invalidates cached identifiers that a change to the stack may have made stale
+    def invalidate_stack_cache(self, stack):
+        names = self.STACK_CACHE_ENTRIES[self.get_stack_kind(stack)]
+        self.cache.invalidate(*names)
+        self.forget(*names)
 
     # function to experiment
     def test(self):
         print(self.api_gateway_url)
 
+    @cached("redirect_lambda_arn", ttl=DAY)
     def get_redirect_lambda_arn(self):
-        self.virginia_lambda_client.list_versions_by_function
-        redirect_lambda_arn = None
-        for function in self.virginia_lambda_client.list_functions()["Functions"]:
-            if function["FunctionName"] == "s3-302-redirect":
-                versions = self.virginia_lambda_client.list_versions_by_function(
-                    FunctionName="s3-302-redirect",
-                )["Versions"]
-                for version in versions:
-                    redirect_lambda_arn = version["FunctionArn"]
-
-        print(redirect_lambda_arn)
+        redirect_lambda_arn = find_latest_function_version_arn(
+            self.clients.get("lambda", "us-east-1"), "s3-302-redirect"
+        )
+        logger.info(f"Redirect lambda ARN: {redirect_lambda_arn}")
         return redirect_lambda_arn
 
+    # get the api gateway id of the zappa setup
+    @cached("api_gateway_id", ttl=DAY)
+    def get_api_gateway_id(self):
+        return find_rest_api_id(self.clients.get("apigateway"), self.lambda_function_name)
+
     # get the api gateway url of the zappa setup
     def get_api_gateway_url(self):
-        api_gateway_client = boto3.client("apigateway")
-        apis = api_gateway_client.get_rest_apis()["items"]
-        api_id = None
-        for api in apis:
-            if api["name"] == self.lambda_function_name:
-                api_id = api["id"]
+        api_id = self.get_api_gateway_id()
         return f"{api_id}.execute-api.{self.infra_config['region']}.amazonaws.com"
 
     # get the ARN of the certificate for the domain of the infra that's being set up
+    @cached("certificate_arn", ttl=7 * DAY)
     def get_certificate_arn(self):
         # certificates must live in N. Virginia
-        acm_client = boto3.client("acm", region_name="us-east-1")
-        certificates = acm_client.list_certificates()["CertificateSummaryList"]
-        certificate_arn = None
-        for certificate in certificates:
-            if certificate["DomainName"] == self.domain:
-                certificate_arn = certificate["CertificateArn"]
-        return certificate_arn
+        return find_certificate_arn(self.clients.get("acm", "us-east-1"), self.domain)
 
     # get backend subnet IDs
+    @cached("subnet_ids", ttl=7 * DAY)
     def get_subnet_ids(self):
-        subnet_ids = []
-        subnets = self.ec2_client.describe_subnets()["Subnets"]
-        for subnet in subnets:
-            tags = subnet.get("Tags")
-            if tags is not None:
-                for tag in tags:
-                    if tag.get("Key") == "aws:cloudformation:logical-id" and tag.get(
-                        "Value"
-                    ).startswith(f"sano{self.org}{self.env}dbsubnet"):
-                        subnet_ids.append(subnet["SubnetId"])
-        return subnet_ids
+        return find_subnet_ids(
+            self.clients.get("ec2"), f"sano{self.org}{self.env}dbsubnet"
+        )
 
     # get backend security group ID
+    @cached("security_group_id", ttl=7 * DAY)
     def get_security_group_id(self):
-        response = self.ec2_client.describe_security_groups(
+        response = self.clients.get("ec2").describe_security_groups(
             Filters=[
                 dict(Name="group-name", Values=[f"{self.SOE}-lambda-security-group"])
             ]
         )
         return response["SecurityGroups"][0]["GroupId"]
 
-    # get backend connection string
-    def get_connection_string(self):
-        instances = self.rds_client.describe_db_instances(
+    def lambda_exists(self):
+        try:
+            self.clients.get("lambda").get_function(
+                FunctionName=self.lambda_function_name
+            )
+        except self.clients.get("lambda").exceptions.ResourceNotFoundException:
+            return False
+        return True
+
+    # whether the zappa lambda exists and has no update in progress
+    def is_lambda_ready(self):
+        try:
+            configuration = self.clients.get("lambda").get_function_configuration(
+                FunctionName=self.lambda_function_name
+            )
+        except self.clients.get("lambda").exceptions.ResourceNotFoundException:
+            return False
+        state = configuration.get("State", "Active")
+        update_status = configuration.get("LastUpdateStatus", "Successful")
+        if state == "Failed" or update_status == "Failed":
+            raise RuntimeError(
+                f"{self.lambda_function_name} lambda function failed: "
+                f"{configuration.get('StateReason') or configuration.get('LastUpdateStatusReason')}"
+            )
+        return state == "Active" and update_status == "Successful"
+
+    # whether the network interfaces zappa's lambda held in the backend security group
+    # have been released, so the security group can be deleted
+    def are_lambda_network_interfaces_released(self):
+        try:
+            security_group_id = self.get_security_group_id()
+        except IndexError:
+            return True
+        network_interfaces = self.clients.get("ec2").describe_network_interfaces(
+            Filters=[dict(Name="group-id", Values=[security_group_id])]
+        )["NetworkInterfaces"]
+        return len(network_interfaces) == 0
+
+    def wait_for_lambda(self, timeout=900):
+        wait_until(
+            self.is_lambda_ready,
+            f"{self.lambda_function_name} lambda function to be ready",
+            timeout=timeout,
+        )
+
+    def wait_for_api_gateway(self, timeout=600):
+        wait_until(
+            self.get_api_gateway_id,
+            f"{self.lambda_function_name} API gateway to exist",
+            timeout=timeout,
+        )
+
+    def wait_for_lambda_network_interfaces(self, timeout=2700):
+        wait_until(
+            self.are_lambda_network_interfaces_released,
+            f"{self.SOE}-lambda-security-group network interfaces to be released",
+            timeout=timeout,
+            max_delay=60,
+        )
+
+    # get backend database host
+    @cached("db_host", ttl=7 * DAY)
+    def get_db_host(self):
+        instances = self.clients.get("rds").describe_db_instances(
             DBInstanceIdentifier=f"{self.SOE}-db"
         )
-        db_host = instances.get("DBInstances")[0].get("Endpoint").get("Address")
+        return instances.get("DBInstances")[0].get("Endpoint").get("Address")
+
+    # get backend connection string
+    def get_connection_string(self):
+        db_host = self.get_db_host()
         return f"postgresql://{self.infra_config['db_username']}:{self.infra_config['db_password']}@{db_host}:5432/{self.env}"
 
-    # gets a context string to be passed through to the CDK to deploy the stacks
-    def get_cdk_context_string(self):
+    # gets a context string to be passed through to the CDK to deploy the given kinds
+    # of stacks, only the frontend stacks need resources discovered from AWS
+    def get_cdk_context_string(self, kinds):
         variables = [
             "org",
             "env",
@@ -137,14 +363,22 @@ class StackManager:
             "domain",
             "portal_subdomain",
             "admin_subdomain",
-            "api_gateway_url",
-            "certificate_arn",
-            "redirect_lambda_arn",
         ]
-        self.infra_config["api_gateway_url"] = self.api_gateway_url
-        self.infra_config["certificate_arn"] = self.certificate_arn
-        self.infra_config["redirect_lambda_arn"] = self.redirect_lambda_arn
+        if kinds & {"portal", "admin"}:
+            variables += ["api_gateway_url", "certificate_arn", "redirect_lambda_arn"]
+            # optional, see stacks/lifecycle.py
+            variables += [
+                name
+                for name in self.FRONTEND_BUCKET_LIFECYCLE_SETTINGS
+                if name in self.infra_config
+            ]
+            (
+                self.infra_config["api_gateway_url"],
+                self.infra_config["certificate_arn"],
+                self.infra_config["redirect_lambda_arn"],
+            ) = self.resolve("api_gateway_url", "certificate_arn", "redirect_lambda_arn")
         context = dict(((k, self.infra_config[k]) for k in variables))
+        context["stacks"] = ",".join(sorted(kinds))
         return " ".join([f"-c {k}={v}" for (k, v) in context.items()])
 
     # runs zappa with specified action
@@ -152,21 +386,154 @@ class StackManager:
         command = f"source venv/bin/activate && zappa {action} {self.env}_{self.org}"
         if action == "undeploy":
             command = command + " --yes"
-        run(command, cwd=self.infra_config["server_dir"])
+        # undeploying an app that isn't deployed fails, which leaves a teardown to carry on
+        run(command, check=action != "undeploy", cwd=self.infra_config["server_dir"])
+        # deploying and undeploying creates and deletes the API gateway
+        if action in ["deploy", "undeploy"]:
+            self.cache.invalidate("api_gateway_id")
+            self.forget("api_gateway_url")
+
+    # synthesizes the given kinds of stacks of the CDK app once for their context and
+    # sources, returning the cloud assembly directory the stacks are deployed from
+    def synthesize(self, kinds, add_aliases="no"):
+        context = f"{self.get_cdk_context_string(kinds)} -c add_aliases={add_aliases}"
+        with self.synth_lock:
+            if self.app_sources_hash is None:
+                self.app_sources_hash = sources_hash()
+            assembly_dir = get_assembly_dir(context, self.app_sources_hash)
+            if is_synthesized(assembly_dir):
+                logger.info(f"Reusing CDK app synthesized in {assembly_dir}")
+                os.utime(assembly_dir)
+                return assembly_dir
+
+            logger.info(f"Synthesizing CDK app into {assembly_dir}")
+            temporary_dir = f"{assembly_dir}.{os.getpid()}.tmp"
+            shutil.rmtree(temporary_dir, ignore_errors=True)
+            run(
+                f"cdk synth --profile {self.aws_profile} {context} --output {temporary_dir} --quiet",
+                check=True,
+            )
+            if not is_synthesized(temporary_dir):
+                raise RuntimeError("Synthesizing the CDK app failed")
+            try:
+                os.rename(temporary_dir, assembly_dir)
+            except OSError:
+                # another run synthesized the same app in the meantime
+                shutil.rmtree(temporary_dir, ignore_errors=True)
+            prune()
+            return assembly_dir
+
+    # stacks live in the region of their CDK environment, where unknown-region means
+    # the profile's region
+    def get_cloudformation_client(self, region):
+        return self.clients.get(
+            "cloudformation", None if region == "unknown-region" else region
+        )
+
+    # returns why a synthesized stack needs deploying, or None when the deployed stack
+    # is settled and already runs the same template and parameters
+    def get_deploy_reason(self, assembly_dir, stack):
+        artifact = StackArtifact(assembly_dir, stack)
+        cloudformation_client = self.get_cloudformation_client(artifact.region)
+        deployed_stack = cfn.get_stack(cloudformation_client, stack)
+        if deployed_stack is None:
+            return "not deployed yet"
+        status = deployed_stack["StackStatus"]
+        # ROLLBACK_COMPLETE stacks failed to create and must be replaced
+        if not status.endswith("_COMPLETE") or status == "ROLLBACK_COMPLETE":
+            return f"stack is {status}"
+
+        template = cloudformation_client.get_template(
+            StackName=stack, TemplateStage="Original"
+        )["TemplateBody"]
+        # the API returns JSON templates parsed, but as a string if it can't
+        if isinstance(template, str):
+            template = json.loads(template)
+        parameters = {
+            parameter["ParameterKey"]: parameter["ParameterValue"]
+            for parameter in deployed_stack.get("Parameters", [])
+        }
+        if template_hash(template, parameters) != template_hash(
+            artifact.template, artifact.parameters
+        ):
+            return "template changed"
+        # cdk deploys the stacks a stack depends on along with it
+        for dependency in artifact.dependencies:
+            reason = self.get_deploy_reason(assembly_dir, dependency)
+            if reason:
+                return f"{dependency} needs deploying, {reason}"
+        return None
 
     # deploy a stack
     def deploy_stack(self, stack, add_aliases="no"):
-        logger.info(f"Deploying {stack}")
+        # cdk deploys the stacks a stack depends on along with it
+        kinds = with_dependencies(self.planned_stacks | {self.get_stack_kind(stack)})
+        assembly_dir = self.synthesize(kinds, add_aliases)
+        if self.force_deploy:
+            reason = "forced"
+        else:
+            reason = self.get_deploy_reason(assembly_dir, stack)
+            if reason is None:
+                logger.info(f"Skipping {stack}, its deployed template is unchanged")
+                return
+        logger.info(f"Deploying {stack} ({reason})")
+        if self.engine == "native":
+            self.deploy_stack_natively(assembly_dir, stack)
+        else:
+            self.deploy_stack_with_cdk(assembly_dir, stack)
+        self.invalidate_stack_cache(stack)
+
+    def deploy_stack_with_cdk(self, assembly_dir, stack):
         run(
-            f"cdk deploy {stack} --profile {self.aws_profile} {self.cdk_context} -c add_aliases={add_aliases} --require-approval never"
+            f"cdk deploy {stack} --app {assembly_dir} --profile {self.aws_profile} --require-approval never",
+            check=True,
+        )
+
+    # deploys a synthesized stack, and the stacks it depends on that need it, through
+    # change sets instead of the cdk CLI
+    def deploy_stack_natively(self, assembly_dir, stack):
+        artifact = StackArtifact(assembly_dir, stack)
+        template_size = len(json.dumps(artifact.template))
+        if artifact.has_assets or template_size > cfn.MAX_TEMPLATE_BODY_SIZE:
+            logger.info(
+                f"Falling back to the cdk CLI for {stack}, it has assets to publish or a large template"
+            )
+            self.deploy_stack_with_cdk(assembly_dir, stack)
+            return
+        for dependency in artifact.dependencies:
+            if self.force_deploy or self.get_deploy_reason(assembly_dir, dependency):
+                self.deploy_stack_natively(assembly_dir, dependency)
+        cfn.deploy_stack(
+            self.get_cloudformation_client(artifact.region),
+            stack,
+            artifact.template,
+            artifact.parameters,
+            artifact.tags,
         )
 
     # destroy a stack
     def destroy_stack(self, stack):
-        logger.info(f"Destroying {stack}")
-        run(
-            f"cdk destroy {stack} --profile {self.aws_profile} {self.cdk_context} --force"
+        # cdk destroys the stacks that depend on a stack along with it
+        kinds = with_dependencies(
+            self.planned_stacks | with_dependents({self.get_stack_kind(stack)})
         )
+        assembly_dir = self.synthesize(kinds)
+        logger.info(f"Destroying {stack}")
+        if self.engine == "native":
+            self.destroy_stack_natively(assembly_dir, stack)
+        else:
+            run(
+                f"cdk destroy {stack} --app {assembly_dir} --profile {self.aws_profile} --force",
+                check=True,
+            )
+        self.invalidate_stack_cache(stack)
+
+    # deletes a synthesized stack, after the stacks that depend on it
+    def destroy_stack_natively(self, assembly_dir, stack):
+        artifact = StackArtifact(assembly_dir, stack)
+        for dependent in artifact.dependents:
+            self.destroy_stack_natively(assembly_dir, dependent)
+        cfn.delete_stack(self.get_cloudformation_client(artifact.region), stack)
 
     def link_zappa_and_set_env_vars(self, setup=False):
         variables = self.server_private_config
@@ -175,7 +542,7 @@ class StackManager:
         variables["base_url"] = self.infra_config["portal_url"]
         variables["admin_url"] = self.infra_config["admin_url"]
         variables["connection_string"] = self.get_connection_string()
-        self.lambda_client.update_function_configuration(
+        self.clients.get("lambda").update_function_configuration(
             FunctionName=self.lambda_function_name,
             Environment={"Variables": variables},
             VpcConfig={
@@ -186,17 +553,28 @@ class StackManager:
             },
         )
 
+    # the cloudfront distributions of the account, listed once per run
+    def get_distribution_index(self):
+        return DistributionIndex(self.clients.get("cloudfront"))
+
+    # get the ID of the portal or admin distribution, by alias when it has one and
+    # otherwise by the comment it was created with (e.g. clients-no-aliases), or from
+    # the resources of its stack
+    @cached("{}_distribution_id", ttl=7 * DAY)
+    def get_distribution_id(self, name):
+        return self.distribution_index.find(
+            alias=f"{self.infra_config[f'{name}_subdomain']}{self.domain}",
+            comment=f"{self.SOE}-{name}",
+        ) or find_stack_distribution_id(
+            self.clients.get("cloudformation"), f"{self.SOE}-{name}-stack"
+        )
+
     def clear_s3_bucket(self, name):
-        s3 = boto3.resource("s3")
-        bucket = s3.Bucket(name)
-        try:
-            bucket.object_versions.all().delete()
-        except Exception:
-            pass
+        empty_bucket(self.clients.get("s3"), name, workers=self.transfer_concurrency)
 
     def unlink_zappa(self):
         try:
-            self.lambda_client.update_function_configuration(
+            self.clients.get("lambda").update_function_configuration(
                 FunctionName=self.lambda_function_name,
                 Environment={},
                 VpcConfig={
@@ -207,79 +585,203 @@ class StackManager:
         except Exception:
             logger.warning(f"{self.lambda_function_name} lambda function not found.")
 
-    def deploy_portal(self, invalidate_cache=True):
-        run(
-            "npm install",
-            cwd=self.portal_dir,
+    def get_build_command(self, name, target):
+        command = f"npm run {target}"
+        if name == "portal":
+            command = f"unset HOST && {command}"
+        return command
+
+    # builds a frontend (portal or admin) through the build cache, returning the cache
+    # entry holding the build output, or None when the build failed
+    def build_frontend(self, name, directory, build_command, output_dir, cache_dir):
+        builds = {name: (directory, build_command, output_dir)}
+        return self.build_frontends(builds, cache_dir)[name]
+
+    # builds several frontends at once through the build cache, see build_frontend()
+    # builds maps each frontend to its (directory, build command, output directory)
+    def build_frontends(self, builds, cache_dir, fail_fast=False):
+        build_caches = {
+            name: BuildCache(directory, build_command, output_dir, cache_dir)
+            for name, (directory, build_command, output_dir) in builds.items()
+        }
+        pending = [name for name, cache in build_caches.items() if not cache.restore()]
+        failed = self.install_frontends(
+            {name: builds[name][0] for name in pending}, fail_fast
         )
-        output = run(
-            f"unset HOST && npm run build-{self.org}-{self.env}",
-            cwd=self.portal_dir,
+        pending = [name for name in pending if name not in failed]
+
+        # builds that log an ERROR are failed even when npm exits cleanly
+        results = run_all(
+            [
+                Command(
+                    name,
+                    builds[name][1],
+                    matchers=[fail_on("ERROR")],
+                    cwd=builds[name][0],
+                )
+                for name in pending
+            ],
+            limit=self.jobs,
+            fail_fast=fail_fast,
         )
-        if "ERROR" in output:
-            return
-        run(
-            f"aws s3 rm s3://{self.SOE}-portal --recursive --profile {self.aws_profile}",
-            cwd=self.portal_dir,
+        for name in pending:
+            if results[name].ok:
+                build_caches[name].store()
+
+        # failed builds have no cache entry
+        return {name: cache.cached_output for name, cache in build_caches.items()}
+
+    # installs the dependencies of the frontends whose lockfile changed since their last
+    # install, returning the ones that failed to install
+    # directories maps each frontend to its directory
+    def install_frontends(self, directories, fail_fast=False):
+        installs = [
+            name for name, directory in directories.items() if needs_install(directory)
+        ]
+        for name in set(directories) - set(installs):
+            logger.info(f"{name} node_modules matches its lockfile, skipping install")
+        results = run_all(
+            [
+                Command(f"{name} install", "npm install", cwd=directories[name])
+                for name in installs
+            ],
+            limit=self.jobs,
+            fail_fast=fail_fast,
         )
-        run(
-            f'aws s3 sync --cache-control "max-age=3600" dist/{self.org}/{self.env}/ s3://{self.SOE}-portal --profile {self.aws_profile}',
-            cwd=self.portal_dir,
+        failed = []
+        for name in installs:
+            if results[f"{name} install"].ok:
+                record_install(directories[name])
+            else:
+                failed.append(name)
+        return failed
+
+    # builds a frontend for this env and syncs its build output to its bucket
+    def deploy_frontend(self, name, directory, build_command, invalidate_cache=True):
+        output_dir = os.path.join(directory, "dist", self.org, self.env)
+        if not self.build_frontend(name, directory, build_command, output_dir, CACHE_DIR):
+            raise RuntimeError(f"Building {name} failed")
+        self.upload_frontend(name, output_dir, invalidate_cache)
+
+    def upload_frontend(self, name, local_dir, invalidate_cache=True):
+        result = sync_directory(
+            self.clients.get("s3"),
+            local_dir,
+            f"{self.SOE}-{name}",
+            policy=AssetPolicy.from_infra_config(self.infra_config),
+            transfer_engine=TransferEngine(
+                self.clients.get("s3"), max_concurrency=self.transfer_concurrency
+            ),
         )
 
         if invalidate_cache:
-            distribution_id = ""
-            for distribution in self.cloudfront_client.list_distributions()[
-                "DistributionList"
-            ]["Items"]:
-                alias = (
-                    distribution["Aliases"]["Items"][0]
-                    if "Items" in distribution["Aliases"]
-                    else None
-                )
-                if f"{self.infra_config['portal_subdomain']}{self.domain}" == alias:
-                    distribution_id = distribution["Id"]
-            run(
-                f'aws cloudfront create-invalidation --distribution-id {distribution_id} --paths "/*" --profile {self.aws_profile}',
-                cwd=self.portal_dir,
+            self.queue_invalidation(
+                self.get_distribution_id(name),
+                invalidation_paths(
+                    result.overwritten,
+                    self.infra_config.get("invalidation_path_limit", DEFAULT_PATH_LIMIT),
+                ),
             )
-
-    def deploy_admin(self, invalidate_cache=True):
-        run(
-            "npm install",
-            cwd=self.admin_dir,
-        )
-        output = run(
-            f"npm run build-{self.org}-{self.env}",
-            cwd=self.admin_dir,
+            if not self.batching_invalidations:
+                self.flush_invalidations()
+
+    # builds the env agnostic release artifact of a frontend, stored under its content
+    # hash, so that every env it is promoted to gets the same bits
+    def build_artifact(self, name):
+        return self.build_artifacts([name])[name]
+
+    # builds the release artifacts of several frontends at once
+    def build_artifacts(self, names):
+        target = self.infra_config.get("artifact_build_target", "build-{org}")
+        output_dir = self.infra_config.get("artifact_output_dir", "dist/{org}/release")
+        builds = {
+            name: (
+                self.infra_config[f"{name}_dir"],
+                self.get_build_command(name, target.format(org=self.org)),
+                os.path.join(
+                    self.infra_config[f"{name}_dir"], output_dir.format(org=self.org)
+                ),
+            )
+            for name in names
+        }
+        artifacts = self.build_frontends(builds, ARTIFACT_DIR, fail_fast=True)
+        for name, artifact in artifacts.items():
+            if artifact is None:
+                raise RuntimeError(f"Building the {name} release artifact failed")
+            logger.info(f"{name} release artifact: {os.path.basename(artifact)}")
+        return artifacts
+
+    # the settings a release artifact reads at runtime instead of baking in at build time
+    def get_runtime_config(self):
+        return {
+            "org": self.org,
+            "env": self.env,
+            "portal_url": self.infra_config["portal_url"],
+            "admin_url": self.infra_config["admin_url"],
+            "api_path": f"/{self.env}_{self.org}",
+        }
+
+    # uploads a frontend's release artifact to this env with this env's runtime config,
+    # building it when it wasn't built up front
+    def promote_frontend(self, name, invalidate_cache=True):
+        artifact = self.release_artifacts.get(name) or self.build_artifact(name)
+        runtime_config_file = self.infra_config.get(
+            "runtime_config_file", "runtime-config.json"
         )
-        if "ERROR" in output:
+        with tempfile.TemporaryDirectory() as staging_dir:
+            release_dir = os.path.join(staging_dir, "release")
+            shutil.copytree(artifact, release_dir)
+            with open(os.path.join(release_dir, runtime_config_file), "w") as fp:
+                json.dump(self.get_runtime_config(), fp, indent=2)
+            logger.info(f"Promoting {name} {os.path.basename(artifact)} to {self.env}")
+            self.upload_frontend(name, release_dir, invalidate_cache)
+
+    def queue_invalidation(self, distribution_id, paths):
+        if not paths:
+            logger.info(f"Nothing changed on distribution {distribution_id}")
             return
-        run(
-            f"aws s3 rm s3://{self.SOE}-admin --recursive --profile {self.aws_profile}",
-            cwd=self.admin_dir,
-        )
-        run(
-            f'aws s3 sync --cache-control "max-age=3600" dist/{self.org}/{self.env} s3://{self.SOE}-admin --profile {self.aws_profile}',
-            cwd=self.admin_dir,
+        with self.invalidations_lock:
+            queued = self.pending_invalidations.setdefault(distribution_id, [])
+            self.pending_invalidations[distribution_id] = (
+                ["/*"] if "/*" in queued + paths else sorted(set(queued + paths))
+            )
+
+    # issues all queued invalidations at once, optionally waiting for them to complete
+    def flush_invalidations(self):
+        with self.invalidations_lock:
+            pending, self.pending_invalidations = self.pending_invalidations, {}
+        if not pending:
+            return
+        invalidation_ids = create_invalidations(self.clients.get("cloudfront"), pending)
+        if self.wait_for_invalidations:
+            wait_for_invalidations(self.clients.get("cloudfront"), invalidation_ids)
+
+    # queues the invalidations of every frontend deployed inside the block and issues
+    # them together at the end
+    @contextmanager
+    def batched_invalidations(self):
+        self.batching_invalidations = True
+        try:
+            yield
+        finally:
+            self.batching_invalidations = False
+            self.flush_invalidations()
+
+    def deploy_portal(self, invalidate_cache=True):
+        self.deploy_frontend(
+            "portal",
+            self.portal_dir,
+            self.get_build_command("portal", f"build-{self.org}-{self.env}"),
+            invalidate_cache,
         )
 
-        if invalidate_cache:
-            distribution_id = ""
-            for distribution in self.cloudfront_client.list_distributions()[
-                "DistributionList"
-            ]["Items"]:
-                alias = (
-                    distribution["Aliases"]["Items"][0]
-                    if "Items" in distribution["Aliases"]
-                    else None
-                )
-                if f"{self.infra_config['admin_subdomain']}{self.domain}" == alias:
-                    distribution_id = distribution["Id"]
-            run(
-                f'aws cloudfront create-invalidation --distribution-id {distribution_id} --paths "/*" --profile {self.aws_profile}',
-                cwd=self.admin_dir,
-            )
+    def deploy_admin(self, invalidate_cache=True):
+        self.deploy_frontend(
+            "admin",
+            self.admin_dir,
+            self.get_build_command("admin", f"build-{self.org}-{self.env}"),
+            invalidate_cache,
+        )
 
     def deploy_server_no_migration(self):
         logger.info("Linking ZAPPA stack to BACKEND stack (auto migration disabled)")
@@ -314,56 +816,141 @@ class StackManager:
         # Destroy VPC stack
         self.destroy_stack(f"sano-{self.org}-vpc-stack")
 
-    def set_up_server(self):
-        # Deploy BACKEND stack
-        self.deploy_stack(f"{self.SOE}-backend-stack")
-
-        logger.info("Deploying ZAPPA stack")
-        self.run_zappa("deploy")
+    def set_up_zappa(self):
+        # zappa refuses to deploy an app that is already deployed, which the update
+        # below brings up to date instead
+        if self.lambda_exists():
+            logger.info("ZAPPA stack is already deployed, updating it instead")
+        else:
+            logger.info("Deploying ZAPPA stack")
+            self.run_zappa("deploy")
         logger.info("Waiting for ZAPPA stack to finish deploying")
-        sleep(120)
+        self.wait_for_lambda()
+        self.wait_for_api_gateway()
         # fetch the API gateway again (in case it was None on initial fetch)
-        self.api_gateway_url = self.get_api_gateway_url()
+        self.forget("api_gateway_url")
         logger.info("Linking ZAPPA stack to BACKEND stack (auto migration enabled)")
         self.link_zappa_and_set_env_vars(setup=True)
         logger.info("Waiting for ZAPPA stack to finish being linked")
-        sleep(120)
+        self.wait_for_lambda()
         logger.info("Updating ZAPPA stack")
         self.run_zappa("update")
         logger.info("Waiting for ZAPPA stack to finish updating")
-        sleep(120)
+        self.wait_for_lambda()
         self.deploy_server()
 
-    def set_up_clients(self, add_aliases="no"):
-        # Deploy PORTAL stack
-        self.deploy_stack(f"{self.SOE}-portal-stack", add_aliases)
-        self.deploy_portal(invalidate_cache=(add_aliases == "yes"))
-
-        # Deploy ADMIN stack
-        self.deploy_stack(f"{self.SOE}-admin-stack", add_aliases)
-        self.deploy_admin(invalidate_cache=(add_aliases == "yes"))
-
-    def set_up_environment(self, add_aliases="no"):
-        self.set_up_server()
-        self.set_up_clients(add_aliases)
-
-    def tear_down_environment(self):
-        # Destroy ADMIN stack
-        self.clear_s3_bucket(f"{self.SOE}-admin")
-        self.destroy_stack(f"{self.SOE}-admin-stack")
-
-        # Destroy PORTAL stack
-        self.clear_s3_bucket(f"{self.SOE}-portal")
-        self.destroy_stack(f"{self.SOE}-portal-stack")
-
-        # Destroy ZAPPA and BACKEND stacks
+    def tear_down_zappa(self):
         logger.info("Unlinking ZAPPA stack from backend")
         self.unlink_zappa()
         logger.info("Destroying ZAPPA stack")
         self.run_zappa("undeploy")
         # the lambda security groups needs the lambda function to be deleted before it can be
         logger.info("Waiting for ZAPPA stack to undeploy")
-        sleep(120)
+        self.wait_for_lambda_network_interfaces()
+
+    # empties the bucket of a stack before destroying it, as cloudformation can't
+    # with expire_buckets a bucket that isn't empty yet is left to expire, and the stack
+    # to a later teardown
+    def destroy_stack_with_bucket(self, stack, bucket):
+        if self.expire_buckets and not is_bucket_empty(self.clients.get("s3"), bucket):
+            expire_bucket(self.clients.get("s3"), bucket)
+            raise RuntimeError(
+                f"Not destroying {stack} until {bucket} has expired, tear it down "
+                "again in a couple of days"
+            )
+        self.clear_s3_bucket(bucket)
+        self.destroy_stack(stack)
+
+    # the stacks and side steps of an org and env, and their real dependencies
+    # frontend stacks only read the API gateway URL of zappa, so they can be torn down
+    # while zappa is undeployed
+    def get_graph(self, add_aliases="no"):
+        invalidate_cache = add_aliases == "yes"
+        return [
+            Node(
+                "certificate",
+                setup=self.set_up_certificate,
+                teardown=self.tear_down_certificate,
+            ),
+            Node("vpc", setup=self.set_up_org, teardown=self.tear_down_org),
+            Node(
+                "backend",
+                setup=lambda: self.deploy_stack(f"{self.SOE}-backend-stack"),
+                teardown=lambda: self.destroy_stack_with_bucket(
+                    f"{self.SOE}-backend-stack", f"{self.SOE}-uploads"
+                ),
+                deps=["vpc"],
+            ),
+            Node(
+                "zappa",
+                setup=self.set_up_zappa,
+                teardown=self.tear_down_zappa,
+                deps=["backend"],
+            ),
+            Node(
+                "portal-stack",
+                setup=lambda: self.deploy_stack(f"{self.SOE}-portal-stack", add_aliases),
+                teardown=lambda: self.destroy_stack_with_bucket(
+                    f"{self.SOE}-portal-stack", f"{self.SOE}-portal"
+                ),
+                deps=["certificate"],
+                setup_only_deps=["zappa"],
+            ),
+            Node(
+                "portal",
+                setup=lambda: self.deploy_portal(invalidate_cache=invalidate_cache),
+                deps=["portal-stack"],
+            ),
+            Node(
+                "admin-stack",
+                setup=lambda: self.deploy_stack(f"{self.SOE}-admin-stack", add_aliases),
+                teardown=lambda: self.destroy_stack_with_bucket(
+                    f"{self.SOE}-admin-stack", f"{self.SOE}-admin"
+                ),
+                deps=["certificate"],
+                setup_only_deps=["zappa"],
+            ),
+            Node(
+                "admin",
+                setup=lambda: self.deploy_admin(invalidate_cache=invalidate_cache),
+                deps=["admin-stack"],
+            ),
+        ]
 
-        self.clear_s3_bucket(f"{self.SOE}-uploads")
-        self.destroy_stack(f"{self.SOE}-backend-stack")
+    # runs the selected nodes of the graph, independent ones concurrently
+    def run_graph(self, selected, action="setup", add_aliases="no"):
+        self.planned_stacks = {
+            self.GRAPH_STACKS[name] for name in selected if name in self.GRAPH_STACKS
+        }
+        try:
+            with self.batched_invalidations():
+                run_graph(
+                    self.get_graph(add_aliases),
+                    selected,
+                    action=action,
+                    width=self.jobs,
+                    fail_fast=not self.keep_going,
+                )
+        finally:
+            self.planned_stacks = set()
+
+    # sets up the certificate and the VPC side by side
+    def set_up_shared(self):
+        self.run_graph(self.SHARED_NODES)
+
+    def tear_down_shared(self):
+        self.run_graph(self.SHARED_NODES, action="teardown")
+
+    def set_up_server(self):
+        self.run_graph(["backend", "zappa"])
+
+    def set_up_clients(self, add_aliases="no"):
+        self.run_graph(
+            ["portal-stack", "portal", "admin-stack", "admin"], add_aliases=add_aliases
+        )
+
+    def set_up_environment(self, add_aliases="no"):
+        self.run_graph(self.ENVIRONMENT_NODES, add_aliases=add_aliases)
+
+    def tear_down_environment(self):
+        self.run_graph(self.ENVIRONMENT_NODES, action="teardown")